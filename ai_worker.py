@@ -0,0 +1,217 @@
+import queue
+import threading
+import time
+from multiprocessing import Process, Queue, RawValue
+
+import engine
+import chess_ai
+
+
+SHUTDOWN_TIMEOUT = 5  # seconds close() waits for the worker to exit before killing it
+
+
+class SearchControl():
+    # The stop flag of the worker's searches, shared between the processes. It holds the id of the
+    # search running and of the last one stopped, so a stop that arrives before its search has even
+    # started still counts and one meant for an earlier search doesn't. The search polls is_set()
+    # every chess_ai.CHECK_INTERVAL nodes.
+    def __init__(self):
+        self.running = RawValue("i", 0)
+        self.stopped = RawValue("i", 0)
+
+    def start(self, search_id):
+        self.running.value = search_id
+
+    def stop(self, search_id):
+        if search_id > self.stopped.value:
+            self.stopped.value = search_id
+
+    def is_set(self):
+        return self.stopped.value >= self.running.value
+
+
+class AIWorker():
+    # A long lived search process with its own copy of the game. The UI only sends it the moves
+    # that are played (as move ids) and search requests, so nothing big is pickled per move and the
+    # transposition table and move ordering tables stay warm for the whole game.
+    def __init__(self, workers=1, time_limit_ms=chess_ai.TIME_LIMIT_MS, stats_path=None):
+        self.workers = workers
+        self.time_limit_ms = time_limit_ms
+        self.commands = Queue()
+        self.results = Queue()
+        self.search_id = 0
+        self.control = SearchControl()
+        self.best_move_id = None  # best move so far of the running search
+        self.stats = None  # SearchStats of the last completed depth or finished search
+        # not a daemon so a parallel search can start its own pool inside it
+        self.process = Process(target=worker_loop, args=(self.commands, self.results, self.control, stats_path))
+        self.process.start()
+
+    def make_move(self, move):
+        self.commands.put(("move", move.moveID))
+
+    def undo_move(self):
+        self.commands.put(("undo",))
+
+    def new_game(self):
+        self.cancel()
+        self.commands.put(("new",))
+
+    def ponder(self):
+        # search on the opponent's time, the worker guesses the reply from its transposition table
+        self.commands.put(("ponder", self.time_limit_ms))
+
+    def start_search(self):
+        self.search_id += 1
+        self.best_move_id = None
+        self.commands.put(("go", self.search_id, self.workers, self.time_limit_ms))
+
+    def stop(self):
+        # move now: the search ends within a few milliseconds and its best move so far is the result
+        self.control.stop(self.search_id)
+
+    def cancel(self):
+        # the search ends the same way but its result is ignored
+        self.control.stop(self.search_id)
+        self.search_id += 1
+
+    def get_result(self):
+        # move id of the finished search, None while it is still thinking, moves can be None too
+        # so the second value says whether a result arrived at all. Progress reports that come in
+        # meanwhile update best_move_id and stats.
+        try:
+            while True:
+                kind, search_id, move_id, stats = self.results.get_nowait()
+                if search_id != self.search_id:
+                    continue
+                self.stats = stats
+                if kind == "result":
+                    return True, move_id
+                self.best_move_id = move_id
+        except queue.Empty:
+            return False, None
+
+    def close(self):
+        # stops whatever is running and lets the worker shut its pool down and exit, only a worker
+        # that doesn't is killed
+        self.cancel()
+        self.commands.put(("quit",))
+        self.process.join(SHUTDOWN_TIMEOUT)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class Ponder():
+    # A search on the opponent's time. It runs in a thread of the worker process so commands keep
+    # coming in meanwhile. With an expected reply that move is made and the position after it searched
+    # as if it had been played, without one the position itself is searched, which only warms the tables.
+    def __init__(self, gs, move, time_limit_ms):
+        self.gs = gs
+        self.move = move
+        self.time_limit_ms = time_limit_ms
+        self.start = time.perf_counter()
+        self.stop = threading.Event()
+        self.timer = None
+        self.played = False
+        self.best_move = None
+        self.stats = None
+        if move is not None:
+            gs.make_move(move)
+        self.thread = threading.Thread(target=self.search)
+        self.thread.start()
+
+    def search(self):
+        valid_moves = self.gs.get_valid_moves()
+        if valid_moves:
+            self.best_move, iterations = chess_ai.iterative_deepening(self.gs, valid_moves, None, stop=self.stop)
+            self.stats = chess_ai.search_stats
+
+    def hit(self):
+        # the expected reply was played, the search carries on for what is left of the time a normal
+        # search would get counting from when pondering started
+        self.played = True
+        remaining = self.time_limit_ms / 1000 - (time.perf_counter() - self.start)
+        if remaining <= 0:
+            self.stop.set()
+        else:
+            self.timer = threading.Timer(remaining, self.stop.set)
+            self.timer.start()
+
+    def finish(self, control=None):
+        # waits for the search to end, returns its move and stats. Setting control stops it early.
+        while self.thread.is_alive():
+            self.thread.join(0.005)
+            if control is not None and control.is_set():
+                self.stop.set()
+        if self.timer is not None:
+            self.timer.cancel()
+        return self.best_move, self.stats
+
+    def abandon(self):
+        # stops the search and takes the expected reply back unless it was played, what the search
+        # stored in the tables stays
+        self.stop.set()
+        self.finish()
+        if self.move is not None and not self.played:
+            self.gs.undo_move()
+
+
+def expected_reply(gs):
+    entry = chess_ai.transposition_table.probe(gs.zobrist_key)
+    if entry is None or entry[4] is None:
+        return None
+    return next((move for move in gs.get_valid_moves() if move.moveID == entry[4]), None)
+
+
+def worker_loop(commands, results, control, stats_path=None):
+    chess_ai.load_book()
+    chess_ai.load_bitbases()
+    if stats_path is not None:
+        chess_ai.stats_stream = open(stats_path, "a")
+    gs = engine.GameState()
+    ponder = None
+    while True:
+        command = commands.get()
+        if ponder is not None:
+            if command[0] == "move" and ponder.move is not None and not ponder.played and ponder.move.moveID == command[1]:
+                ponder.hit()
+                continue
+            if command[0] != "go" or not ponder.played:
+                ponder.abandon()
+                ponder = None
+        if command[0] == "move":
+            for move in gs.get_valid_moves():
+                if move.moveID == command[1]:
+                    gs.make_move(move)
+                    break
+        elif command[0] == "undo":
+            gs.undo_move()
+        elif command[0] == "new":
+            gs = engine.GameState()
+            chess_ai.transposition_table.clear()
+        elif command[0] == "ponder":
+            ponder = Ponder(gs, expected_reply(gs), command[1])
+        elif command[0] == "go":
+            search_id, workers, time_limit_ms = command[1:]
+            control.start(search_id)
+            best_move = None
+            if ponder is not None:
+                best_move, stats = ponder.finish(control)
+                ponder = None
+            if best_move is None:
+                valid_moves = gs.get_valid_moves()
+                return_queue = queue.Queue()
+                if workers > 1:
+                    best_move, stats = chess_ai.find_best_move_parallel(gs, valid_moves, return_queue, workers,
+                                                                        time_limit_ms, stop=control)
+                else:
+                    report = lambda move, stats: results.put(("update", search_id, move.moveID, stats))
+                    best_move, stats = chess_ai.find_best_move(gs, valid_moves, return_queue, time_limit_ms,
+                                                               stop=control, report=report)
+            results.put(("result", search_id, best_move.moveID if best_move is not None else None, stats))
+        elif command[0] == "quit":
+            if chess_ai.search_pool is not None:
+                chess_ai.search_pool.shutdown()
+            if chess_ai.stats_stream is not None:
+                chess_ai.stats_stream.close()
+            break
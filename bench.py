@@ -0,0 +1,174 @@
+import sys
+import time
+import tracemalloc
+from queue import Queue
+
+import engine
+import chess_ai
+import perft
+
+# positions given as the moves leading to them from the starting position
+POSITIONS = [
+    ("start", ""),
+    ("italian", "e2e4 e7e5 g1f3 b8c6 f1c4 g8f6 d2d3 f8c5 c2c3 d7d6 b1d2 c8g4 h2h3 g4h5 d1b3 d8d7"),
+    ("queens gambit", "d2d4 d7d5 c2c4 e7e6 b1c3 g8f6 c1g5 f8e7 e2e3 e8g8 g1f3 b8d7 a1c1 c7c6"),
+    ("sicilian", "e2e4 c7c5 g1f3 d7d6 d2d4 c5d4 f3d4 g8f6 b1c3 a7a6 c1e3 e7e5 d4b3 c8e6 f2f3 b8d7"),
+    ("open centre", "e2e4 e7e5 d2d4 e5d4 d1d4 b8c6 d4e3 g8f6 b1c3 f8b4 c1d2 e8g8 e1c1 f8e8 f1c4 d7d6"),
+]
+
+
+def set_up_position(moves):
+    gs = engine.GameState()
+    for notation in moves.split():
+        for move in gs.get_valid_moves():
+            if move.get_notation() == notation:
+                gs.make_move(move)
+                break
+        else:
+            raise ValueError("illegal move {} in {}".format(notation, moves))
+    return gs
+
+
+def search(gs, **kwargs):
+    chess_ai.transposition_table.clear()
+    start = time.perf_counter()
+    chess_ai.find_best_move(gs, gs.get_valid_moves(), Queue(), **kwargs)
+    return chess_ai.nodes_searched, time.perf_counter() - start
+
+
+def bench_ordering(depth=3):
+    orderers = [("generation order", chess_ai.MoveOrderer(False, False, False, False)),
+                ("tt move", chess_ai.MoveOrderer(True, False, False, False)),
+                ("+ mvv-lva", chess_ai.MoveOrderer(True, True, False, False)),
+                ("+ killers", chess_ai.MoveOrderer(True, True, True, False)),
+                ("+ history", chess_ai.MoveOrderer(True, True, True, True))]
+    totals = [0] * len(orderers)
+    print("nodes to depth {}".format(depth))
+    print("{:<16}".format("position") + "".join("{:>18}".format(name) for name, orderer in orderers))
+    for name, moves in POSITIONS:
+        gs = set_up_position(moves)
+        row = "{:<16}".format(name)
+        for i, (orderer_name, orderer) in enumerate(orderers):
+            nodes, seconds = search(gs, time_limit_ms=None, max_depth=depth, orderer=orderer)
+            totals[i] += nodes
+            row += "{:>18}".format(nodes)
+        print(row)
+    print("{:<16}".format("total") + "".join("{:>18}".format(total) for total in totals))
+    print("{:<16}".format("reduction") + "".join("{:>17.1f}%".format(100 - 100 * total / totals[0]) for total in totals))
+    chess_ai.move_orderer = chess_ai.MoveOrderer()
+
+
+def bench_parallel(depth=3, workers=chess_ai.WORKERS):
+    print("time to depth {} with {} workers".format(depth, workers))
+    print("{:<16}{:>12}{:>12}{:>12}{:>12}{:>10}".format("position", "1 process", "nodes", "parallel", "nodes", "speedup"))
+    total_single = total_parallel = 0
+    # start the pool up front so its start-up is not charged to the first position
+    chess_ai.get_search_pool(workers)
+    for name, moves in POSITIONS:
+        gs = set_up_position(moves)
+        single_nodes, single = search(gs, time_limit_ms=None, max_depth=depth)
+        chess_ai.transposition_table.clear()
+        start = time.perf_counter()
+        chess_ai.find_best_move_parallel(gs, gs.get_valid_moves(), Queue(), workers, time_limit_ms=None, max_depth=depth)
+        parallel = time.perf_counter() - start
+        total_single += single
+        total_parallel += parallel
+        print("{:<16}{:>11.2f}s{:>12}{:>11.2f}s{:>12}{:>9.2f}x".format(name, single, single_nodes, parallel,
+                                                                    chess_ai.nodes_searched, single / parallel))
+    print("{:<16}{:>11.2f}s{:>12}{:>11.2f}s{:>12}{:>9.2f}x".format("total", total_single, "", total_parallel, "",
+                                                                total_single / total_parallel))
+
+
+def bench_moves(max_nodes=100000):
+    # cost of Move objects over the perft suite: construction time, make/unmake time, memory held per
+    # generated move and the resulting perft speed
+    positions = [engine.GameState(fen) for name, fen, expected in perft.PERFT_SUITE]
+    position_moves = [(gs.board, gs.get_valid_moves()) for gs in positions]
+    count = sum(len(moves) for board, moves in position_moves) * 100
+    start = time.perf_counter()
+    for i in range(100):
+        for board, moves in position_moves:
+            for move in moves:
+                engine.Move((move.start_row, move.start_col), (move.end_row, move.end_col), board)
+    construct = (time.perf_counter() - start) / count
+    start = time.perf_counter()
+    for i in range(100):
+        for board, moves in position_moves:
+            for move in moves:
+                engine.Move.from_squares(move.start_sq, move.end_sq, board)
+    generated = (time.perf_counter() - start) / count
+    print("Move() {:.2f}us, Move.from_squares {:.2f}us per move".format(construct * 1e6, generated * 1e6))
+    start = time.perf_counter()
+    for i in range(100):
+        for gs, (board, moves) in zip(positions, position_moves):
+            for move in moves:
+                gs.make_move(move)
+                gs.undo_move()
+    print("make_move + undo_move {:.2f}us per move".format((time.perf_counter() - start) / count * 1e6))
+
+    tracemalloc.start()
+    kept = [gs.get_valid_moves() for gs in positions * 20]
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("{:.1f} bytes held per generated move".format(memory / sum(len(moves) for moves in kept)))
+
+    nodes = 0
+    start = time.perf_counter()
+    for name, fen, expected in perft.PERFT_SUITE:
+        gs = engine.GameState(fen)
+        for depth, expected_nodes in enumerate(expected, 1):
+            if expected_nodes <= max_nodes:
+                nodes += perft.perft(gs, depth)
+    seconds = time.perf_counter() - start
+    print("perft suite {} nodes in {:.2f}s, {:.0f} nps".format(nodes, seconds, nodes / seconds))
+
+
+def bench_quiescence(depth=3):
+    # depth with quiescence against the same depth and one ply more without it
+    columns = [("depth {} + qs".format(depth), depth, True), ("depth {}".format(depth), depth, False),
+               ("depth {}".format(depth + 1), depth + 1, False)]
+    print("{:<16}".format("position") + "".join("{:>24}".format(name) for name, d, quiescence in columns))
+    totals = [0] * len(columns)
+    for name, moves in POSITIONS:
+        gs = set_up_position(moves)
+        row = "{:<16}".format(name)
+        for i, (column, d, quiescence) in enumerate(columns):
+            chess_ai.use_quiescence = quiescence
+            nodes, seconds = search(gs, time_limit_ms=None, max_depth=d)
+            totals[i] += seconds
+            row += "{:>12}{:>11.2f}s".format(nodes, seconds)
+        print(row)
+    print("{:<16}".format("total") + "".join("{:>23.2f}s".format(total) for total in totals))
+    chess_ai.use_quiescence = True
+
+
+
+def bench_selective(time_limit_ms=2000):
+    # depth completed in a fixed time with each part of the selective search added in turn
+    switches = ["use_null_move", "use_late_move_reductions", "use_pvs", "use_aspiration"]
+    columns = [("full width", []), ("+ null move", switches[:1]), ("+ lmr", switches[:2]), ("+ pvs", switches[:3]),
+               ("+ aspiration", switches)]
+    print("depth (nodes) in {}ms".format(time_limit_ms))
+    print("{:<16}".format("position") + "".join("{:>16}".format(name) for name, enabled in columns))
+    totals = [0] * len(columns)
+    for name, moves in POSITIONS:
+        gs = set_up_position(moves)
+        row = "{:<16}".format(name)
+        for i, (column, enabled) in enumerate(columns):
+            for switch in switches:
+                setattr(chess_ai, switch, switch in enabled)
+            search(gs, time_limit_ms=time_limit_ms)
+            totals[i] += chess_ai.search_stats.depth
+            row += "{:>16}".format("{} ({})".format(chess_ai.search_stats.depth, chess_ai.nodes_searched))
+        print(row)
+    print("{:<16}".format("mean depth") + "".join("{:>16.1f}".format(total / len(POSITIONS)) for total in totals))
+    for switch in switches:
+        setattr(chess_ai, switch, True)
+
+
+BENCHMARKS = {"ordering": bench_ordering, "parallel": bench_parallel, "moves": bench_moves, "quiescence": bench_quiescence,
+              "selective": bench_selective}
+
+if __name__ == "__main__":
+    name = sys.argv[1] if len(sys.argv) > 1 else "ordering"
+    BENCHMARKS[name](*[int(arg) for arg in sys.argv[2:]])
@@ -0,0 +1,246 @@
+import os
+import random
+import sys
+import time
+
+import engine
+
+# Win/draw bitbases for king and one piece against a bare king. The side with the piece is always
+# stored as white, positions with black holding the piece are looked up mirrored top to bottom.
+# Bit index: ((side to move * 64 + strong king) * 64 + weak king) * 64 + piece square, with side
+# to move 0 for the strong side and 1 for the lone king, set when the strong side wins.
+BITBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bitbases")
+TABLE_SIZE = 2 * 64 * 64 * 64
+# pawn endings promote into the queen and rook tables so those are built first
+TABLES = ("q", "r", "p")
+VERIFY_POSITIONS = 6000
+
+
+def index(weak_to_move, strong_king, weak_king, piece_sq):
+    return ((weak_to_move * 64 + strong_king) * 64 + weak_king) * 64 + piece_sq
+
+
+def piece_attacks(piece, sq, occupied):
+    if piece == "p":
+        return engine.PAWN_ATTACKS["w"][sq]
+    return engine.slider_attacks(sq, occupied, engine.SLIDER_DIRECTIONS[piece])
+
+
+def squares(bitboard):
+    while bitboard:
+        bit = bitboard & -bitboard
+        bitboard ^= bit
+        yield bit.bit_length() - 1
+
+
+def generate(piece, promotions=()):
+    # retrograde fixed point over every legal position, one byte per position while generating:
+    # the lone king loses once every move it has leads to a win, the strong side wins once any of
+    # its moves does, repeated until nothing changes. promotions are the finished tables of the
+    # pieces a pawn can usefully promote to.
+    win = bytearray(TABLE_SIZE)
+    strong_positions = []
+    weak_positions = []
+    for strong_king in range(64):
+        for weak_king in range(64):
+            if strong_king == weak_king or (engine.KING_ATTACKS[strong_king] >> weak_king) & 1:
+                continue
+            for piece_sq in range(64):
+                if piece_sq in (strong_king, weak_king) or (piece == "p" and (piece_sq < 8 or piece_sq >= 56)):
+                    continue
+                weak_positions.append((strong_king, weak_king, piece_sq))
+                occupied = (1 << strong_king) | (1 << weak_king)
+                # with the strong side to move the lone king can't be in check
+                if not (piece_attacks(piece, piece_sq, occupied) >> weak_king) & 1:
+                    strong_positions.append((strong_king, weak_king, piece_sq))
+
+    changed = True
+    while changed:
+        changed = False
+        undecided = []
+        for position in weak_positions:
+            result = weak_king_loses(piece, win, *position)
+            if result:
+                win[index(1, *position)] = 1
+                changed = True
+            elif result is not None:
+                undecided.append(position)
+        weak_positions = undecided
+        undecided = []
+        for position in strong_positions:
+            if strong_side_wins(piece, win, promotions, *position):
+                win[index(0, *position)] = 1
+                changed = True
+            else:
+                undecided.append(position)
+        strong_positions = undecided
+    return win
+
+
+def weak_king_loses(piece, win, strong_king, weak_king, piece_sq):
+    # True when lost, False while undecided, None when it is a draw whatever happens elsewhere
+    # (stalemate or the piece can be taken)
+    # the lone king is left off the board so sliders see through it
+    occupied = (1 << strong_king) | (1 << piece_sq)
+    attacked = engine.KING_ATTACKS[strong_king] | piece_attacks(piece, piece_sq, occupied)
+    targets = engine.KING_ATTACKS[weak_king] & ~attacked
+    if not targets:
+        return True if (attacked >> weak_king) & 1 else None
+    if (targets >> piece_sq) & 1:
+        return None
+    for target in squares(targets):
+        if not win[index(0, strong_king, target, piece_sq)]:
+            return False
+    return True
+
+
+def strong_side_wins(piece, win, promotions, strong_king, weak_king, piece_sq):
+    for target in squares(engine.KING_ATTACKS[strong_king] & ~engine.KING_ATTACKS[weak_king] & ~(1 << piece_sq)):
+        if win[index(1, target, weak_king, piece_sq)]:
+            return True
+    occupied = (1 << strong_king) | (1 << weak_king)
+    if piece != "p":
+        for target in squares(piece_attacks(piece, piece_sq, occupied) & ~occupied):
+            if win[index(1, strong_king, weak_king, target)]:
+                return True
+        return False
+    push = piece_sq - 8
+    if (occupied >> push) & 1:
+        return False
+    if push < 8:
+        return any(table[index(1, strong_king, weak_king, push)] for table in promotions)
+    if win[index(1, strong_king, weak_king, push)]:
+        return True
+    return piece_sq >= 48 and not (occupied >> (push - 8)) & 1 and bool(win[index(1, strong_king, weak_king, push - 8)])
+
+
+def pack(win):
+    packed = bytearray(TABLE_SIZE // 8)
+    for i in range(0, TABLE_SIZE, 8):
+        packed[i >> 3] = win[i] | win[i + 1] << 1 | win[i + 2] << 2 | win[i + 3] << 3 | \
+                         win[i + 4] << 4 | win[i + 5] << 5 | win[i + 6] << 6 | win[i + 7] << 7
+    return bytes(packed)
+
+
+def build(directory=BITBASE_DIR):
+    os.makedirs(directory, exist_ok=True)
+    tables = {}
+    for piece in TABLES:
+        start = time.perf_counter()
+        promotions = (tables["q"], tables["r"]) if piece == "p" else ()
+        tables[piece] = generate(piece, promotions)
+        with open(os.path.join(directory, "k{}k.bin".format(piece)), "wb") as f:
+            f.write(pack(tables[piece]))
+        print("k{}k: {} winning positions in {:.1f}s".format(piece, sum(tables[piece]), time.perf_counter() - start))
+
+
+def verify(directory=BITBASE_DIR, positions=VERIFY_POSITIONS, seed=0):
+    # checks the tables against the rules on random legal positions, either side holding the piece:
+    # every result has to follow from a one-ply lookahead through GameState.get_valid_moves, the side
+    # to move wins when one of its moves leads to a loss, loses when mated or every move leads to a
+    # win, and draws otherwise. Positions left with no table (piece taken, minor promotion) are draws.
+    # returns the number of mismatches
+    bitbases = Bitbases(directory)
+    rng = random.Random(seed)
+    failures = 0
+    for piece in TABLES:
+        if piece not in bitbases.tables:
+            print("k{}k: no table in {}".format(piece, directory))
+            failures += 1
+            continue
+        start = time.perf_counter()
+        wins = mismatches = 0
+        for i in range(positions):
+            gs = engine.GameState(random_fen(rng, piece))
+            result = bitbases.probe(gs)
+            expected = lookahead(gs, bitbases)
+            wins += result != 0
+            if result != expected:
+                mismatches += 1
+                print("k{}k: {} is {} in the table, {} by lookahead".format(piece, gs.get_fen(), result, expected))
+        failures += mismatches
+        print("k{}k: {} positions, {} decided, {} mismatches in {:.1f}s".format(
+            piece, positions, wins, mismatches, time.perf_counter() - start))
+    return failures
+
+
+def random_fen(rng, piece):
+    # a legal position with king and piece against king, the side not to move can't be in check
+    while True:
+        strong = rng.choice("wb")
+        strong_king, weak_king, piece_sq = rng.sample(range(64), 3)
+        if (engine.KING_ATTACKS[strong_king] >> weak_king) & 1:
+            continue
+        if piece == "p" and (piece_sq < 8 or piece_sq >= 56):
+            continue
+        white_to_move = rng.random() < 0.5
+        # the table works from white's side, the position is mirrored for black holding the piece
+        mirror = 56 if strong == "b" else 0
+        weak_to_move = white_to_move != (strong == "w")
+        occupied = (1 << strong_king) | (1 << weak_king)
+        if not weak_to_move and (piece_attacks(piece, piece_sq, occupied) >> weak_king) & 1:
+            continue
+        gs = engine.GameState("8/8/8/8/8/8/8/8 {} - - 0 1".format("w" if white_to_move else "b"))
+        weak = "b" if strong == "w" else "w"
+        for sq, name in ((strong_king, strong + "k"), (weak_king, weak + "k"), (piece_sq, strong + piece)):
+            gs.put_piece(sq ^ mirror, name)
+        return gs.get_fen()
+
+
+def lookahead(gs, bitbases):
+    moves = gs.get_valid_moves()
+    if not moves:
+        return -1 if gs.checkmate else 0
+    best = -1
+    for move in moves:
+        gs.make_move(move)
+        result = bitbases.probe(gs)
+        gs.undo_move()
+        best = max(best, -result if result is not None else 0)
+    return best
+
+
+class Bitbases():
+    def __init__(self, directory=BITBASE_DIR):
+        # whichever tables exist, 64KB each
+        self.tables = {}
+        for piece in TABLES:
+            path = os.path.join(directory, "k{}k.bin".format(piece))
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    self.tables[piece] = f.read()
+
+    def probe(self, gs):
+        # 1 when the side to move wins, -1 when it loses, 0 for a draw, None when there is no table
+        occupied = gs.all_occupancy
+        if bin(occupied).count("1") != 3:
+            return None
+        for piece, table in self.tables.items():
+            for strong, weak in (("w", "b"), ("b", "w")):
+                piece_bitboard = gs.bitboards[strong + piece]
+                if not piece_bitboard:
+                    continue
+                strong_king = gs.bitboards[strong + "k"].bit_length() - 1
+                weak_king = gs.bitboards[weak + "k"].bit_length() - 1
+                piece_sq = piece_bitboard.bit_length() - 1
+                if strong == "b":
+                    strong_king ^= 56
+                    weak_king ^= 56
+                    piece_sq ^= 56
+                weak_to_move = 0 if gs.white_to_move == (strong == "w") else 1
+                i = index(weak_to_move, strong_king, weak_king, piece_sq)
+                if not (table[i >> 3] >> (i & 7)) & 1:
+                    return 0
+                return -1 if weak_to_move else 1
+        return None
+
+
+if __name__ == "__main__":
+    # bitbase.py build [directory] | bitbase.py verify [directory [positions]]
+    if len(sys.argv) > 1 and sys.argv[1] == "build":
+        build(sys.argv[2] if len(sys.argv) > 2 else BITBASE_DIR)
+    elif len(sys.argv) > 1 and sys.argv[1] == "verify":
+        sys.exit(1 if verify(sys.argv[2] if len(sys.argv) > 2 else BITBASE_DIR,
+                             int(sys.argv[3]) if len(sys.argv) > 3 else VERIFY_POSITIONS) else 0)
+    else:
+        print("usage: bitbase.py build [directory] | bitbase.py verify [directory [positions]]")
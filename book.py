@@ -0,0 +1,204 @@
+import mmap
+import os
+import random
+import re
+import struct
+import sys
+import time
+
+import engine
+
+# the book is a file of fixed size entries sorted by key: zobrist key, move id, weight
+ENTRY = struct.Struct("<QHH")
+KEY = struct.Struct("<Q")
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "book.bin")
+MAX_BOOK_PLY = 20  # moves deeper into a game than this are not added to the book
+MAX_WEIGHT = 0xFFFF
+
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQnbrq]))?$")
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+
+class OpeningBook():
+    # The file is mapped rather than read, lookups binary search it in place. Every process using the
+    # same book shares the one copy in the page cache instead of holding its own.
+    def __init__(self, path=BOOK_PATH):
+        self.file = open(path, "rb")
+        self.count = os.fstat(self.file.fileno()).st_size // ENTRY.size
+        # an empty file can't be mapped
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.count else b""
+
+    def close(self):
+        if self.count:
+            self.data.close()
+        self.file.close()
+
+    def entries(self, key):
+        # (move id, weight) of every book move from the position with this key
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if KEY.unpack_from(self.data, mid * ENTRY.size)[0] < key:
+                low = mid + 1
+            else:
+                high = mid
+        entries = []
+        while low < self.count:
+            entry_key, move_id, weight = ENTRY.unpack_from(self.data, low * ENTRY.size)
+            if entry_key != key:
+                break
+            entries.append((move_id, weight))
+            low += 1
+        return entries
+
+    def choose_move(self, gs, valid_moves, rng=random):
+        # a book move picked at random in proportion to its weight, None once the game leaves the book
+        moves = {move.moveID: move for move in valid_moves}
+        candidates = [(moves[move_id], weight) for move_id, weight in self.entries(gs.zobrist_key) if move_id in moves]
+        if not candidates:
+            return None
+        return rng.choices([move for move, weight in candidates], [weight for move, weight in candidates])[0]
+
+
+def parse_move(gs, notation, valid_moves=None):
+    # a move given in coordinate (e2e4, e7e8q) or standard algebraic notation, None if it isn't legal here
+    if valid_moves is None:
+        valid_moves = gs.get_valid_moves()
+    for move in valid_moves:
+        if move.get_notation() == notation:
+            return move
+    san = notation.rstrip("+#!?")
+    if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        side = 2 if len(san) == 3 else -2
+        return next((move for move in valid_moves if move.is_castle_move and move.end_col - move.start_col == side), None)
+    match = SAN_PATTERN.match(san)
+    if match is None:
+        return None
+    piece, from_file, from_rank, target, promotion = match.groups()
+    piece = piece.lower() if piece else "p"
+    end_row = engine.Move.ranks_to_rows[target[1]]
+    end_col = engine.Move.files_to_cols[target[0]]
+    for move in valid_moves:
+        if move.piece_moved[1] != piece or move.end_row != end_row or move.end_col != end_col:
+            continue
+        if from_file is not None and move.start_col != engine.Move.files_to_cols[from_file]:
+            continue
+        if from_rank is not None and move.start_row != engine.Move.ranks_to_rows[from_rank]:
+            continue
+        if move.is_pawn_promotion and move.promotion_piece != (promotion or "q").lower():
+            continue
+        return move
+    return None
+
+
+def move_to_san(gs, move, valid_moves=None):
+    # standard algebraic notation of a legal move, the inverse of parse_move
+    if valid_moves is None:
+        valid_moves = gs.get_valid_moves()
+    if move.is_castle_move:
+        san = "O-O" if move.end_col > move.start_col else "O-O-O"
+    else:
+        piece = move.piece_moved[1]
+        start = move.get_rank_file(move.start_row, move.start_col)
+        target = move.get_rank_file(move.end_row, move.end_col)
+        capture = "x" if move.piece_captured != "--" else ""
+        if piece == "p":
+            san = (start[0] + capture if capture else "") + target
+            if move.is_pawn_promotion:
+                san += "=" + move.promotion_piece.upper()
+        else:
+            # name the start file, rank or both when another piece of the same kind can go there too
+            others = [other for other in valid_moves if other.piece_moved == move.piece_moved and
+                      other.end_sq == move.end_sq and other.start_sq != move.start_sq]
+            if not others:
+                disambiguation = ""
+            elif all(other.start_col != move.start_col for other in others):
+                disambiguation = start[0]
+            elif all(other.start_row != move.start_row for other in others):
+                disambiguation = start[1]
+            else:
+                disambiguation = start
+            san = piece.upper() + disambiguation + capture + target
+    gs.make_move(move)
+    if gs.incheck():
+        san += "#" if not gs.get_valid_moves() else "+"
+    gs.undo_move()
+    return san
+
+
+def read_games(path):
+    # yields the moves of every game in a PGN file, or of every line in a file of coordinate move lists
+    with open(path) as f:
+        text = f.read()
+    if not path.endswith(".pgn"):
+        for line in text.splitlines():
+            if line.split():
+                yield line.split()
+        return
+    # comments, variations and annotation glyphs say nothing about the moves actually played
+    text = re.sub(r"\{[^}]*\}|;[^\n]*|\$\d+", " ", text)
+    while "(" in text:
+        text, count = re.subn(r"\([^()]*\)", " ", text)
+        if not count:
+            break
+    moves = []
+    for line in text.splitlines():
+        if line.startswith("["):
+            if moves:
+                yield moves
+                moves = []
+            continue
+        for token in line.split():
+            if token in RESULTS:
+                if moves:
+                    yield moves
+                moves = []
+                continue
+            token = re.sub(r"^\d+\.+", "", token)
+            if token:
+                moves.append(token)
+    if moves:
+        yield moves
+
+
+def build_book(games, path=BOOK_PATH, max_ply=MAX_BOOK_PLY, min_count=1):
+    # every move played in the first max_ply plies of the games becomes an entry weighted by how often
+    # it was played, returns the number of entries written
+    counts = {}
+    for moves in games:
+        gs = engine.GameState()
+        for notation in moves[:max_ply]:
+            move = parse_move(gs, notation)
+            if move is None:
+                break
+            key = (gs.zobrist_key, move.moveID)
+            counts[key] = counts.get(key, 0) + 1
+            gs.make_move(move)
+    entries = sorted((key, move_id, min(count, MAX_WEIGHT)) for (key, move_id), count in counts.items()
+                     if count >= min_count)
+    with open(path, "wb") as f:
+        for entry in entries:
+            f.write(ENTRY.pack(*entry))
+    return len(entries)
+
+
+if __name__ == "__main__":
+    # book.py build <games.pgn|moves.txt> [book] [max_ply] | book.py probe [fen] [book]
+    if len(sys.argv) > 2 and sys.argv[1] == "build":
+        path = sys.argv[3] if len(sys.argv) > 3 else BOOK_PATH
+        max_ply = int(sys.argv[4]) if len(sys.argv) > 4 else MAX_BOOK_PLY
+        start = time.perf_counter()
+        count = build_book(read_games(sys.argv[2]), path, max_ply)
+        print("{} entries written to {} in {:.2f}s".format(count, path, time.perf_counter() - start))
+    elif len(sys.argv) > 1 and sys.argv[1] == "probe":
+        gs = engine.GameState(sys.argv[2] if len(sys.argv) > 2 and sys.argv[2] else None)
+        opening_book = OpeningBook(sys.argv[3] if len(sys.argv) > 3 else BOOK_PATH)
+        moves = {move.moveID: move for move in gs.get_valid_moves()}
+        start = time.perf_counter()
+        entries = opening_book.entries(gs.zobrist_key)
+        seconds = time.perf_counter() - start
+        for move_id, weight in sorted(entries, key=lambda entry: -entry[1]):
+            print("{} {}".format(moves[move_id].get_notation() if move_id in moves else move_id, weight))
+        print("{} moves in {:.1f}us".format(len(entries), seconds * 1e6))
+    else:
+        print("usage: book.py build <games.pgn|moves.txt> [book] [max_ply] | book.py probe [fen] [book]")
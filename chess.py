@@ -1,13 +1,22 @@
 import pygame
 import engine
 import chess_ai
+import ai_worker
 import sys
-from multiprocessing import Process, Queue
 
 WIDTH = HEIGHT = 480
 DIMENSION = 8
 SQUARE_SIZE = HEIGHT // DIMENSION
-MAX_FPS = 15
+ANIMATION_FPS = 60
+ANIMATION_FRAMES_PER_SQUARE = 4
+AI_POLL_MS = 20  # how often a running search is checked for its result, otherwise the UI sleeps until an event
+AI_WORKERS = 1  # more than one splits the AI search over that many processes
+STATUS_HEIGHT = 36  # search statistics of the AI's last move are shown under the board
+STATS_PATH = None  # file every AI search is also logged to as JSON lines, when set
+PONDER = True  # the AI keeps searching on the expected reply while the human thinks
+SQUARE_COLORS = [pygame.Color(224, 249, 222), pygame.Color(113, 198, 113)]
+SELECTION_COLOR = pygame.Color(245, 246, 143)
+LAST_MOVE_COLOR = pygame.Color(255, 246, 143)
 IMAGES = {}
 
 
@@ -19,7 +28,8 @@ def load_images():
 
 def main():
     pygame.init()
-    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    screen = pygame.display.set_mode((WIDTH, HEIGHT + STATUS_HEIGHT))
+    font = pygame.font.SysFont("monospace", 12)
     clock = pygame.time.Clock()
     screen.fill(pygame.Color("white"))
     gs = engine.GameState()
@@ -30,6 +40,7 @@ def main():
     game_over = False
 
     load_images()
+    view = BoardView(screen, font)
     running = True
     selected = ()
     clicks = []
@@ -38,34 +49,39 @@ def main():
     piececaptured = pygame.mixer.Sound("audio/piececaptured.wav")
     gameover = pygame.mixer.Sound("audio/gameover.wav")
     startup = pygame.mixer.Sound("audio/startup.wav")
-    startup_sound_played = False
+    startup.play()
     gameover_sound_played = False
     w_player = True
     b_player = False
 
     ai_thinking = False
     move_undone = False
-    move_finder_process = None
+    ai = ai_worker.AIWorker(AI_WORKERS, stats_path=STATS_PATH)
 
     while running:
-
-        if startup_sound_played == False:
-            startup.play()
-            startup_sound_played = True
-
-        if gameover_sound_played == False and game_over:
-            gameover.play()
-            gameover_sound_played = True
-
+        # frames only run while something moves on screen, a search is polled every AI_POLL_MS,
+        # otherwise nothing happens until the next event
         human_playing = (gs.white_to_move and w_player) or (not gs.white_to_move and b_player)
+        if view.animating():
+            clock.tick(ANIMATION_FPS)
+            events = pygame.event.get()
+        elif ai_thinking:
+            events = [pygame.event.wait(AI_POLL_MS)] + pygame.event.get()
+        elif not game_over and not human_playing and not move_undone:
+            events = pygame.event.get()
+        else:
+            events = [pygame.event.wait()] + pygame.event.get()
 
-        for e in pygame.event.get():
+        for e in events:
             if e.type == pygame.QUIT:
                 running = False
+                ai.close()
                 sys.exit()
+            elif e.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                view.invalidate()
             elif e.type == pygame.MOUSEBUTTONDOWN:
-                if not game_over:
-                    location = pygame.mouse.get_pos()
+                location = e.pos
+                if not game_over and location[1] < HEIGHT:
                     col = location[0]//SQUARE_SIZE
                     row = location[1]//SQUARE_SIZE
                     if selected == (row, col):
@@ -84,6 +100,7 @@ def main():
                                 else:
                                     piececaptured.play()
                                 gs.make_move(valid_moves[i])
+                                ai.make_move(valid_moves[i])
                                 made = True
                                 animate_move = True
                                 selected = ()
@@ -91,118 +108,174 @@ def main():
                         if not made:
                             clicks = [selected]
             elif e.type == pygame.KEYDOWN:
-                if e.key == pygame.K_LEFT:
+                if e.key == pygame.K_SPACE and ai_thinking:
+                    # move now with the best move found so far
+                    ai.stop()
+                elif e.key == pygame.K_LEFT:
                     if len(move_log) != 0:
                         piecemoved.play()
+                    if len(move_log) != 0:
+                        ai.undo_move()
                     gs.undo_move()
                     made = True
                     animate_move = False
                     game_over = False
+                    gameover_sound_played = False
                     if ai_thinking:
-                        move_finder_process.terminate()
+                        ai.cancel()
                         ai_thinking = False
                     move_undone = True
 
-            #AI
-            if not game_over and not human_playing and not move_undone:
-                if not ai_thinking:
-                    ai_thinking = True
-                    return_queue = Queue()
-                    move_finder_process = Process(target=chess_ai.find_best_move, args = (gs, valid_moves, return_queue))
-                    move_finder_process.start()
-                if not move_finder_process.is_alive():
-                    ai_move = return_queue.get()
-                    if ai_move is None:
-                        ai_move = chess_ai.find_random_move(valid_moves)
-                    gs.make_move(ai_move)
-                    made = True
-                    animate_move = True
-                    ai_thinking = False
-
-            if made:
-                if animate_move:
-                    animate(gs.move_log[-1], screen, gs.board, clock)
-                valid_moves = gs.get_valid_moves()
-                made = False
-                animate_move = False
-                move_undone = False
-
-
-
-        draw_game_state(screen, gs, valid_moves, selected, move_log)
-
-        if gs.checkmate:
-            game_over = True
-
-        elif gs.stalemate:
-            game_over = True
-
-        clock.tick(MAX_FPS)
-        pygame.display.flip()
-
-def draw_game_state(screen, gs, valid_moves, selected, move_log):
-    draw_board(screen)
-    draw_moves(screen, gs, valid_moves, selected, move_log)
-    draw_pieces(screen, gs.board)
-
-def draw_board(screen):
-    colors = [pygame.Color(224, 249, 222), pygame.Color(113, 198, 113)] 
-    #pygame.Color(113, 198, 113), pygame.Color(224, 249, 222)
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            color = colors[((r+c)%2)]
-            pygame.draw.rect(screen, color, pygame.Rect(c*SQUARE_SIZE, r*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-
-def draw_pieces(screen, board):
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece != "--":
-                screen.blit(IMAGES[piece], pygame.Rect(c*SQUARE_SIZE, r*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-
-def draw_moves(screen, gs, valid_moves, selected, move_log):
-    color2 = pygame.Color(255,246,143)
-    color = pygame.Color(245,246,143)
-
-    if selected != ():
-        r, c = selected
-        if gs.board[r][c][0] == ("w" if gs.white_to_move else "b"):
-            s = pygame.Surface((SQUARE_SIZE, SQUARE_SIZE))
-            s.set_alpha(100)
-            s.fill(color)
-            screen.blit(s, (c*SQUARE_SIZE, r * SQUARE_SIZE))
-            s.fill(color)
-            for move in valid_moves:
-                if move.start_row == r and move.start_col == c:
-                    screen.blit(s, (move.end_col*SQUARE_SIZE, move.end_row*SQUARE_SIZE))
-    if move_log:
-        move = move_log[-1]
-        s = pygame.Surface((SQUARE_SIZE, SQUARE_SIZE))
-        s.set_alpha(80)
-        s.fill(color2)
-        screen.blit(s, (move.start_col*SQUARE_SIZE, move.start_row*SQUARE_SIZE))
-        screen.blit(s, (move.end_col*SQUARE_SIZE, move.end_row*SQUARE_SIZE))
-
-
-
-def animate(move, screen, board, clock):
-    colors = [pygame.Color(224, 249, 222), pygame.Color(113, 198, 113)]
-    delta_row = move.end_row - move.start_row
-    delta_col = move.end_col - move.start_col
-    fps = 4
-    frame_count = (abs(delta_row) + abs(delta_col)) * fps
-    for frame in range(frame_count + 1):
-        r, c = (move.start_row + delta_row*frame/frame_count, move.start_col + delta_col*frame/frame_count)
-        draw_board(screen)
-        draw_pieces(screen,board)
-        color = colors[(move.end_row + move.end_col) % 2]
-        end = pygame.Rect(move.end_col*SQUARE_SIZE, move.end_row*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-        pygame.draw.rect(screen,color,end)
-        if move.piece_captured != "--":
-            screen.blit(IMAGES[move.piece_captured], end)
-        screen.blit(IMAGES[move.piece_moved], pygame.Rect(c*SQUARE_SIZE, r*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-        pygame.display.flip()
-        clock.tick(60)
+        #AI
+        human_playing = (gs.white_to_move and w_player) or (not gs.white_to_move and b_player)
+        if not game_over and not human_playing and not move_undone and not made:
+            if not ai_thinking:
+                ai_thinking = True
+                ai.start_search()
+            finished, ai_move_id = ai.get_result()
+            if finished:
+                ai_move = None
+                for move in valid_moves:
+                    if move.moveID == ai_move_id:
+                        ai_move = move
+                if ai_move is None:
+                    ai_move = chess_ai.find_random_move(valid_moves)
+                gs.make_move(ai_move)
+                ai.make_move(ai_move)
+                if PONDER and ((gs.white_to_move and w_player) or (not gs.white_to_move and b_player)):
+                    ai.ponder()
+                made = True
+                animate_move = True
+                ai_thinking = False
+        elif ai_thinking:
+            # progress reports still come in
+            ai.get_result()
+        move_undone = False
+
+        if made:
+            if animate_move:
+                view.animate(gs.move_log[-1])
+            valid_moves = gs.get_valid_moves()
+            made = False
+            animate_move = False
+            game_over = gs.checkmate or gs.stalemate or gs.is_draw()
+
+        if game_over and not gameover_sound_played:
+            gameover.play()
+            gameover_sound_played = True
+
+        view.draw(gs, valid_moves, selected, ai.stats)
+
+
+class BoardView():
+    # Remembers what every square shows so a frame only redraws the squares whose piece or highlight
+    # changed, copied from a board background drawn once, and only their rects go to the display.
+    def __init__(self, screen, font):
+        self.screen = screen
+        self.font = font
+        self.background = pygame.Surface((WIDTH, HEIGHT))
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                pygame.draw.rect(self.background, SQUARE_COLORS[(r+c)%2], square_rect(r, c))
+        self.selection_overlay = overlay(SELECTION_COLOR, 100)
+        self.last_move_overlay = overlay(LAST_MOVE_COLOR, 80)
+        self.shown = [None] * (DIMENSION * DIMENSION)
+        self.status_shown = None
+        self.animation = None  # (move, start ticks, duration in ms)
+        self.sprite_rect = None
+
+    def invalidate(self):
+        # everything is drawn again on the next frame, after the window was covered for instance
+        self.shown = [None] * (DIMENSION * DIMENSION)
+        self.status_shown = None
+
+    def animate(self, move):
+        squares = abs(move.end_row - move.start_row) + abs(move.end_col - move.start_col)
+        self.animation = (move, pygame.time.get_ticks(), squares * ANIMATION_FRAMES_PER_SQUARE * 1000 // ANIMATION_FPS)
+
+    def animating(self):
+        return self.animation is not None
+
+    def draw(self, gs, valid_moves, selected, stats):
+        highlighted = set()
+        if selected != ():
+            r, c = selected
+            if gs.board[r][c][0] == ("w" if gs.white_to_move else "b"):
+                highlighted.add(r*DIMENSION + c)
+                highlighted.update(move.end_sq for move in valid_moves if move.start_row == r and move.start_col == c)
+        last_move = {gs.move_log[-1].start_sq, gs.move_log[-1].end_sq} if gs.move_log else set()
+
+        # the moving piece is drawn over the board where it is along its way, until it gets there the
+        # end square keeps whatever was captured on it
+        animated_move = sprite_rect = None
+        if self.animation is not None:
+            move, start, duration = self.animation
+            progress = (pygame.time.get_ticks() - start) / duration if duration else 1
+            if progress >= 1:
+                self.animation = None
+            else:
+                animated_move = move
+                r = move.start_row + (move.end_row - move.start_row)*progress
+                c = move.start_col + (move.end_col - move.start_col)*progress
+                sprite_rect = pygame.Rect(round(c*SQUARE_SIZE), round(r*SQUARE_SIZE), SQUARE_SIZE, SQUARE_SIZE)
+        # squares the piece covered last frame or covers now are drawn again underneath it
+        covered = squares_under(self.sprite_rect) | squares_under(sprite_rect)
+
+        dirty = []
+        for sq, (r, c) in enumerate(engine.SQUARE_COORDS):
+            piece = gs.board[r][c]
+            if animated_move is not None and sq == animated_move.end_sq:
+                piece = animated_move.piece_captured
+            state = (piece, sq in highlighted, sq in last_move)
+            if state != self.shown[sq] or sq in covered:
+                dirty.append(self.draw_square(r, c, state))
+                self.shown[sq] = state
+        if sprite_rect is not None:
+            self.screen.blit(IMAGES[animated_move.piece_moved], sprite_rect)
+            dirty.append(sprite_rect)
+        self.sprite_rect = sprite_rect
+
+        status = stats.summary() if stats is not None else ""
+        if status != self.status_shown:
+            dirty.append(self.draw_status(status))
+            self.status_shown = status
+        if dirty:
+            pygame.display.update(dirty)
+
+    def draw_square(self, r, c, state):
+        piece, highlighted, last_move = state
+        rect = square_rect(r, c)
+        self.screen.blit(self.background, rect, rect)
+        if highlighted:
+            self.screen.blit(self.selection_overlay, rect)
+        if last_move:
+            self.screen.blit(self.last_move_overlay, rect)
+        if piece != "--":
+            self.screen.blit(IMAGES[piece], rect)
+        return rect
+
+    def draw_status(self, status):
+        rect = pygame.Rect(0, HEIGHT, WIDTH, STATUS_HEIGHT)
+        pygame.draw.rect(self.screen, pygame.Color("white"), rect)
+        for i, line in enumerate(status.split("\n") if status else []):
+            self.screen.blit(self.font.render(line, True, pygame.Color("black")), (4, HEIGHT + 3 + i*15))
+        return rect
+
+def square_rect(r, c):
+    return pygame.Rect(c*SQUARE_SIZE, r*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+
+def squares_under(rect):
+    if rect is None:
+        return set()
+    rows = range(max(rect.top//SQUARE_SIZE, 0), min((rect.bottom - 1)//SQUARE_SIZE, DIMENSION - 1) + 1)
+    cols = range(max(rect.left//SQUARE_SIZE, 0), min((rect.right - 1)//SQUARE_SIZE, DIMENSION - 1) + 1)
+    return {r*DIMENSION + c for r in rows for c in cols}
+
+def overlay(color, alpha):
+    s = pygame.Surface((SQUARE_SIZE, SQUARE_SIZE))
+    s.set_alpha(alpha)
+    s.fill(color)
+    return s
 
 if __name__ == "__main__":
     main()
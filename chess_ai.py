@@ -1,88 +1,686 @@
+import json
+import os
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-piece_score = {"k": 0, "q": 10, "r": 5, "b": 3, "n": 3, "p": 1}
-
-knight_scores = [[0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0],
-                 [0.1, 0.3, 0.5, 0.5, 0.5, 0.5, 0.3, 0.1],
-                 [0.2, 0.5, 0.6, 0.65, 0.65, 0.6, 0.5, 0.2],
-                 [0.2, 0.55, 0.65, 0.7, 0.7, 0.65, 0.55, 0.2],
-                 [0.2, 0.5, 0.65, 0.7, 0.7, 0.65, 0.5, 0.2],
-                 [0.2, 0.55, 0.6, 0.65, 0.65, 0.6, 0.55, 0.2],
-                 [0.1, 0.3, 0.5, 0.55, 0.55, 0.5, 0.3, 0.1],
-                 [0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0]]
-
-bishop_scores = [[0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
-                 [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
-                 [0.2, 0.4, 0.5, 0.6, 0.6, 0.5, 0.4, 0.2],
-                 [0.2, 0.5, 0.5, 0.6, 0.6, 0.5, 0.5, 0.2],
-                 [0.2, 0.4, 0.6, 0.6, 0.6, 0.6, 0.4, 0.2],
-                 [0.2, 0.6, 0.6, 0.6, 0.6, 0.6, 0.6, 0.2],
-                 [0.2, 0.5, 0.4, 0.4, 0.4, 0.4, 0.5, 0.2],
-                 [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0]]
-
-rook_scores = [[0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25],
-               [0.5, 0.75, 0.75, 0.75, 0.75, 0.75, 0.75, 0.5],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.25, 0.25, 0.25, 0.5, 0.5, 0.25, 0.25, 0.25]]
-
-queen_scores = [[0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0],
-                [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
-                [0.2, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
-                [0.3, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
-                [0.4, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
-                [0.2, 0.5, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
-                [0.2, 0.4, 0.5, 0.4, 0.4, 0.4, 0.4, 0.2],
-                [0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0]]
-
-pawn_scores = [[0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8],
-               [0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7],
-               [0.3, 0.3, 0.4, 0.5, 0.5, 0.4, 0.3, 0.3],
-               [0.25, 0.25, 0.3, 0.9, 0.85, 0.3, 0.25, 0.25],
-               [0.2, 0.2, 0.2, 0.85, 0.9, 0.2, 0.2, 0.2],
-               [0.25, 0.15, 0.1, 0.2, 0.2, 0.1, 0.15, 0.25],
-               [0.25, 0.3, 0.3, 0.0, 0.0, 0.3, 0.3, 0.25],
-               [0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2]]
-
-piece_position_scores = {"wn": knight_scores,
-                         "bn": knight_scores[::-1],
-                         "wb": bishop_scores,
-                         "bb": bishop_scores[::-1],
-                         "wq": queen_scores,
-                         "bq": queen_scores[::-1],
-                         "wr": rook_scores,
-                         "br": rook_scores[::-1],
-                         "wp": pawn_scores,
-                         "bp": pawn_scores[::-1]}
-CHECKMATE = 1000
+import bitbase
+import book
+import engine
+
+# numpy is optional and only score_boards needs it, so it is imported on first use rather than
+# adding most of a tenth of a second to every start-up
+np = None
+
+# the evaluation tables live in engine, whose GameState keeps their sum up to date move by move
+piece_score = engine.piece_score
+# the search works in whole hundredths of a pawn, like GameState.evaluation, so windows can be a
+# single unit wide. Scores are only turned into pawns for display.
+piece_centipawns = {piece: 100 * value for piece, value in piece_score.items()}
+piece_position_scores = engine.piece_position_scores
+square_scores = engine.SQUARE_SCORES
+
+CHECKMATE = 100000
 STALEMATE = 0
-DEPTH = 3
+MAX_DEPTH = 32
+TIME_LIMIT_MS = 2000
+WORKERS = os.cpu_count() or 1
+MIN_SHARE_MOVES = 2  # fewest root moves a parallel search worker is given
+CHECK_INTERVAL = 63  # nodes between clock checks, must be one less than a power of two
+# mate scores are CHECKMATE - ply, anything beyond this is a forced mate
+MATE_THRESHOLD = CHECKMATE - 100
 
-def find_best_move(gs, valid_moves, return_queue):
-    global next_move
-    next_move = None
-    random.shuffle(valid_moves)
-    negamax_alphabeta_algo(gs, valid_moves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gs.white_to_move else -1 )
-    return_queue.put(next_move)
+# bitbase wins score above anything the evaluation reaches and below every mate
+TB_WIN = 50000
+
+# a capture has to be able to lift the score this close to alpha to be searched in quiescence
+DELTA_MARGIN = 200
+
+# selective search
+NULL_WINDOW = 1  # scores are whole centipawns, so (alpha, alpha + 1) is a null window
+NULL_MOVE_REDUCTION = 2  # plies taken off the search after passing, on top of the pass itself
+LMR_MIN_DEPTH = 3
+LMR_MIN_MOVES = 3  # moves searched to full depth before quiet ones start being reduced
+ASPIRATION_WINDOW = 100  # root window around the last iteration's score
+
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+TT_SIZE = 1 << 18
+
+
+class TranspositionTable():
+    def __init__(self, size=TT_SIZE):
+        self.size = size
+        self.mask = size - 1  # size must be a power of two
+        self.entries = [None] * size
+        self.generation = 0
+
+    def clear(self):
+        self.entries = [None] * self.size
+        self.generation = 0
+
+    def new_search(self):
+        self.generation += 1
+
+    def discard(self, key):
+        if self.probe(key) is not None:
+            self.entries[key & self.mask] = None
+
+    def probe(self, key):
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, flag, score, move_id):
+        index = key & self.mask
+        entry = self.entries[index]
+        # keep the deeper result of the current search, anything from an older search can go
+        if entry is None or entry[0] == key or entry[5] != self.generation or depth >= entry[1]:
+            self.entries[index] = (key, depth, flag, score, move_id, self.generation)
+
+
+transposition_table = TranspositionTable()
+
+
+def score_to_tt(score, ply):
+    # mate scores are stored relative to the node so they stay valid when reached through another path
+    if score > MATE_THRESHOLD:
+        return score + ply
+    if score < -MATE_THRESHOLD:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    if score > MATE_THRESHOLD:
+        return score - ply
+    if score < -MATE_THRESHOLD:
+        return score + ply
+    return score
+
+
+MAX_PLY = 64
+# ordering scores: hash move, then captures/promotions, then killers, then history
+TT_MOVE_SCORE = 1000000
+CAPTURE_SCORE = 100000
+KILLER_SCORES = (90000, 80000)
+HISTORY_LIMIT = 79999
+
+
+def mvv_lva(move):
+    # most valuable victim first, least valuable attacker breaks ties
+    victim = piece_score[move.piece_captured[1]] if move.piece_captured != "--" else 0
+    if move.is_pawn_promotion:
+        victim += piece_score[move.promotion_piece]
+    return victim * 10 - piece_score[move.piece_moved[1]]
+
+
+class MoveOrderer():
+    def __init__(self, tt_move=True, captures=True, killers=True, history=True, shuffle=False):
+        self.use_tt_move = tt_move
+        self.use_captures = captures
+        self.use_killers = killers
+        self.use_history = history
+        self.shuffle = shuffle  # random order among moves with equal scores
+        self.killers = [[None, None] for ply in range(MAX_PLY)]
+        self.history = {}
+
+    def new_search(self):
+        self.killers = [[None, None] for ply in range(MAX_PLY)]
+        # older history is kept but counts for less
+        for key in self.history:
+            self.history[key] //= 4
+
+    def order_moves(self, moves, ply, tt_move_id=None):
+        if self.shuffle:
+            random.shuffle(moves)
+        killers = self.killers[ply] if self.use_killers and ply < MAX_PLY else (None, None)
+        moves.sort(key=lambda move: self.score_move(move, tt_move_id, killers), reverse=True)
+
+    def score_move(self, move, tt_move_id, killers):
+        if self.use_tt_move and move.moveID == tt_move_id:
+            return TT_MOVE_SCORE
+        if self.use_captures and (move.piece_captured != "--" or move.is_pawn_promotion):
+            return CAPTURE_SCORE + mvv_lva(move)
+        if move.moveID == killers[0]:
+            return KILLER_SCORES[0]
+        if move.moveID == killers[1]:
+            return KILLER_SCORES[1]
+        if self.use_history:
+            return min(self.history.get((move.piece_moved, move.end_row, move.end_col), 0), HISTORY_LIMIT)
+        return 0
+
+    def update(self, move, depth, ply):
+        # called for the move that caused a beta cutoff, only quiet moves are remembered
+        if move.piece_captured != "--" or move.is_pawn_promotion:
+            return
+        if self.use_killers and ply < MAX_PLY:
+            killers = self.killers[ply]
+            if killers[0] != move.moveID:
+                killers[1] = killers[0]
+                killers[0] = move.moveID
+        if self.use_history:
+            key = (move.piece_moved, move.end_row, move.end_col)
+            self.history[key] = self.history.get(key, 0) + depth * depth
+
+
+class SearchStats():
+    # What a search did: running totals plus one entry per completed depth. With a stream (any open
+    # text file) every depth is written to it as a JSON line as soon as it finishes, then a summary line.
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.start = time.perf_counter()
+        self.seconds = 0
+        self.nodes = 0  # every node, quiescence ones included
+        self.qnodes = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.from_book = False
+        self.depths = []
+
+    def __getstate__(self):
+        # the stream stays behind when stats are sent to another process
+        return dict(self.__dict__, stream=None)
+
+    @property
+    def nps(self):
+        return self.nodes / self.seconds if self.seconds else 0
+
+    @property
+    def tt_hit_rate(self):
+        return self.tt_hits / self.tt_probes if self.tt_probes else 0
+
+    @property
+    def first_move_cutoff_rate(self):
+        # share of beta cutoffs made by the first move searched, how good the move ordering is
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0
+
+    @property
+    def depth(self):
+        return self.depths[-1]["depth"] if self.depths else 0
+
+    @property
+    def score(self):
+        return self.depths[-1]["score"] if self.depths else None
+
+    @property
+    def pv(self):
+        return self.depths[-1]["pv"] if self.depths else []
+
+    def add_depth(self, depth, score, pv):
+        # called as each iteration completes, score in centipawns for the side to move, pv is a list of moves
+        # from the root
+        elapsed = time.perf_counter() - self.start
+        previous = self.depths[-1]["time_ms"] if self.depths else 0
+        self.depths.append({"depth": depth, "score": score, "nodes": self.nodes, "qnodes": self.qnodes,
+                            "time_ms": round(elapsed * 1000), "depth_time_ms": round(elapsed * 1000) - previous,
+                            "pv": [move.get_notation() for move in pv]})
+        self.write(dict(self.depths[-1], type="depth"))
+
+    def finish(self, nodes):
+        self.nodes = nodes
+        self.seconds = time.perf_counter() - self.start
+        self.write(dict(self.as_dict(), type="search"))
+
+    def as_dict(self):
+        return {"nodes": self.nodes, "qnodes": self.qnodes, "seconds": round(self.seconds, 3), "nps": round(self.nps),
+                "tt_hit_rate": round(self.tt_hit_rate, 3), "first_move_cutoff_rate": round(self.first_move_cutoff_rate, 3),
+                "book": self.from_book, "depth": self.depth, "score": self.score, "pv": self.pv, "depths": self.depths}
+
+    def write(self, record):
+        if self.stream is not None:
+            self.stream.write(json.dumps(record) + "\n")
+            self.stream.flush()
+
+    def summary(self):
+        # two short lines for a status bar
+        if self.from_book:
+            return "book move"
+        return "depth {}  score {}  {} nodes ({:.0%} q)  {:.0f}k nps\ntt hits {:.0%}  first move cutoffs {:.0%}  pv {}".format(
+            self.depth, "{:+.2f}".format(self.score / 100) if self.score is not None else "-", self.nodes,
+            self.qnodes / self.nodes if self.nodes else 0, self.nps / 1000, self.tt_hit_rate,
+            self.first_move_cutoff_rate, " ".join(self.pv[:4]))
+
+    def merge(self, results):
+        # totals of the root splitting workers' stats, each depth taken from the worker that scored best
+        # there and only as deep as all of them got
+        for stats in results:
+            self.nodes += stats.nodes
+            self.qnodes += stats.qnodes
+            self.tt_probes += stats.tt_probes
+            self.tt_hits += stats.tt_hits
+            self.cutoffs += stats.cutoffs
+            self.first_move_cutoffs += stats.first_move_cutoffs
+        for i in range(min(len(stats.depths) for stats in results)):
+            best = max((stats.depths[i] for stats in results), key=lambda entry: entry["score"])
+            self.depths.append(dict(best, nodes=sum(stats.depths[i]["nodes"] for stats in results),
+                                    qnodes=sum(stats.depths[i]["qnodes"] for stats in results),
+                                    time_ms=max(stats.depths[i]["time_ms"] for stats in results)))
+            self.write(dict(self.depths[-1], type="depth"))
+
+
+move_orderer = MoveOrderer()
+use_quiescence = True
+# each part of the selective search can be switched off on its own
+use_null_move = True
+use_late_move_reductions = True
+use_pvs = True
+use_aspiration = True
+stats_stream = None  # file the statistics of every search are written to as JSON lines
+search_stats = SearchStats()
+opening_book = None
+bitbases = None
+nodes_searched = 0
+search_deadline = None
+search_stop = None  # threading.Event (or anything with is_set) another thread or process can set to end the search early
+search_node_limit = None
+search_aborted = False
+bitbase_root = False
+
+
+def load_book(path=book.BOOK_PATH):
+    # searches play from the book while the position is in it, when there is a book file
+    global opening_book
+    if os.path.exists(path):
+        opening_book = book.OpeningBook(path)
+
+def book_move(gs, valid_moves):
+    return opening_book.choose_move(gs, valid_moves) if opening_book is not None else None
 
-def negamax_alphabeta_algo(gs, valid_moves, depth, alpha, beta, turn_multiplier):
+def load_bitbases(directory=bitbase.BITBASE_DIR):
+    # three piece endings are scored from the bitbases instead of searched, when they have been built
+    global bitbases
+    if os.path.isdir(directory):
+        bitbases = bitbase.Bitbases(directory)
+
+def bitbase_score(gs):
+    # exact result from the side to move's point of view, None when no bitbase covers the position
+    if bitbases is None:
+        return None
+    result = bitbases.probe(gs)
+    if not result:
+        return result
+    return result * (TB_WIN + winning_progress(gs))
+
+def winning_progress(gs):
+    # bitbases only know won or drawn, this keeps the search heading for the mate: more material first
+    # (so pawns promote), then pawns further up, the lone king nearer the edge and the kings closer together
+    strong, weak = ("w", "b") if gs.occupancy["w"] & (gs.occupancy["w"] - 1) else ("b", "w")
+    progress = 0
+    for piece in "qrp":
+        bitboard = gs.bitboards[strong + piece]
+        if bitboard:
+            progress += piece_centipawns[piece]
+            if piece == "p":
+                row = engine.SQUARE_COORDS[bitboard.bit_length() - 1][0]
+                progress += 50 * (6 - row if strong == "w" else row - 1)
+    strong_row, strong_col = engine.SQUARE_COORDS[gs.bitboards[strong + "k"].bit_length() - 1]
+    weak_row, weak_col = engine.SQUARE_COORDS[gs.bitboards[weak + "k"].bit_length() - 1]
+    centre_distance = max(3 - weak_row, weak_row - 4) + max(3 - weak_col, weak_col - 4)
+    king_distance = max(abs(strong_row - weak_row), abs(strong_col - weak_col))
+    return progress + 10 * (centre_distance - king_distance)
+
+def find_best_move(gs, valid_moves, return_queue, time_limit_ms=TIME_LIMIT_MS, node_limit=None, max_depth=MAX_DEPTH,
+                   orderer=None, stop=None, report=None):
+    # puts the move on return_queue and returns it together with the SearchStats of the search
+    best_move = book_move(gs, valid_moves)
+    if best_move is None:
+        best_move, iterations = iterative_deepening(gs, valid_moves, time_limit_ms, node_limit, max_depth, orderer, stop,
+                                                    report)
+        stats = search_stats
+    else:
+        stats = book_stats()
+    return_queue.put(best_move)
+    return best_move, stats
+
+def book_stats():
+    stats = SearchStats(stats_stream)
+    stats.from_book = True
+    stats.finish(0)
+    return stats
+
+def iterative_deepening(gs, valid_moves, time_limit_ms=TIME_LIMIT_MS, node_limit=None, max_depth=MAX_DEPTH, orderer=None,
+                        stop=None, report=None, root_share=False):
+    # returns the move to play and (depth, score, move) for every completed iteration, the rest of
+    # what the search did is left in search_stats. Once set, stop ends the search within CHECK_INTERVAL
+    # nodes and the best move of the deepest completed iteration is returned. report(move, stats) is
+    # called as every iteration completes. With root_share valid_moves are only part of the root moves,
+    # so a single one is searched like any other to be compared with the other shares.
+    global next_move, nodes_searched, search_deadline, search_node_limit, search_aborted, move_orderer, bitbase_root
+    global search_stop, search_stats
+    if orderer is not None:
+        move_orderer = orderer
+    transposition_table.new_search()
+    move_orderer.new_search()
+    search_stats = SearchStats(stats_stream)
+    nodes_searched = 0
+    search_aborted = False
+    search_deadline = time.perf_counter() + time_limit_ms / 1000 if time_limit_ms is not None else None
+    search_node_limit = node_limit
+    search_stop = stop
+    bitbase_root = bitbase_score(gs) is not None
+    best_move = None
+    iterations = []
+    if len(valid_moves) == 1 and not root_share:
+        best_move = valid_moves[0]
+        max_depth = 0
+    score = 0
+    for depth in range(1, max_depth + 1):
+        score = aspiration_search(gs, valid_moves, depth, score)
+        if search_aborted:
+            # an unfinished iteration only counts when there is nothing better
+            if best_move is None:
+                best_move = next_move
+            break
+        # the root TT entry makes the next iteration start with this move and line
+        best_move = next_move
+        if best_move is None:
+            break
+        iterations.append((depth, score, best_move))
+        search_stats.nodes = nodes_searched
+        search_stats.add_depth(depth, score, principal_variation(gs, best_move, depth))
+        if report is not None:
+            report(best_move, search_stats)
+        if abs(score) > MATE_THRESHOLD:
+            break
+    search_stats.finish(nodes_searched)
+    return best_move, iterations
+
+def aspiration_search(gs, valid_moves, depth, previous_score):
+    # the root searched in a narrow window around the last iteration's score, which cuts more, and
+    # searched again with that side opened up whenever the score falls outside it
     global next_move
+    turn_multiplier = 1 if gs.white_to_move else -1
+    alpha, beta = -CHECKMATE, CHECKMATE
+    if use_aspiration and depth > 1 and abs(previous_score) < MATE_THRESHOLD:
+        alpha, beta = previous_score - ASPIRATION_WINDOW, previous_score + ASPIRATION_WINDOW
+    while True:
+        next_move = None
+        score = negamax_alphabeta_algo(gs, valid_moves, depth, alpha, beta, turn_multiplier)
+        if search_aborted:
+            return score
+        if score <= alpha and alpha > -CHECKMATE:
+            alpha = -CHECKMATE
+        elif score >= beta and beta < CHECKMATE:
+            beta = CHECKMATE
+        else:
+            return score
+
+def has_pieces(gs):
+    # with nothing but king and pawns zugzwang is common enough that passing can't be trusted to be worse
+    color = "w" if gs.white_to_move else "b"
+    return gs.occupancy[color] != gs.bitboards[color + "k"] | gs.bitboards[color + "p"]
+
+def principal_variation(gs, best_move, length):
+    # the root move and the line the transposition table holds after it, cut short where an entry has
+    # been overwritten
+    pv = [best_move]
+    gs.make_move(best_move)
+    while len(pv) < length:
+        entry = transposition_table.probe(gs.zobrist_key)
+        if entry is None or entry[4] is None:
+            break
+        move = next((move for move in gs.get_valid_moves() if move.moveID == entry[4]), None)
+        if move is None:
+            break
+        pv.append(move)
+        gs.make_move(move)
+    for move in pv:
+        gs.undo_move()
+    return pv
+
+def find_best_move_parallel(gs, valid_moves, return_queue, workers=WORKERS, time_limit_ms=TIME_LIMIT_MS, node_limit=None,
+                            max_depth=MAX_DEPTH, stop=None):
+    # root splitting: the root moves are dealt out to worker processes which each run the normal
+    # iterative deepening over their share, the results are merged at the deepest depth all of them finished
+    # returns the move with the merged SearchStats of the workers like find_best_move
+    global nodes_searched, search_stats
+    best_move = book_move(gs, valid_moves)
+    if best_move is not None:
+        return_queue.put(best_move)
+        return best_move, book_stats()
+    # every worker gets at least MIN_SHARE_MOVES moves, splitting finer only adds processes that each
+    # repeat the same start-up iterations
+    workers = min(workers, len(valid_moves) // MIN_SHARE_MOVES)
+    if workers <= 1:
+        return find_best_move(gs, valid_moves, return_queue, time_limit_ms, node_limit, max_depth, stop=stop)
+    # deal the moves out in ordering order so every worker gets some of the promising ones
+    move_orderer.order_moves(valid_moves, 0)
+    shares = [[move.moveID for move in valid_moves[i::workers]] for i in range(workers)]
+    worker_node_limit = node_limit // workers if node_limit is not None else None
+    search_stats = SearchStats(stats_stream)
+    pool = get_search_pool(workers, stop)
+    futures = [pool.submit(search_root_moves, gs, share, time_limit_ms, worker_node_limit, max_depth) for share in shares]
+    results = [future.result() for future in futures]
+    nodes_searched = sum(stats.nodes for best_move_id, iterations, stats in results)
+    search_stats.merge([stats for best_move_id, iterations, stats in results])
+
+    best_move_id = None
+    common_depth = min(len(iterations) for best_move_id, iterations, stats in results)
+    if common_depth > 0:
+        best_score = -CHECKMATE - 1
+        for worker_best_move_id, iterations, stats in results:
+            depth, score, move_id = iterations[common_depth - 1]
+            if score > best_score:
+                best_score = score
+                best_move_id = move_id
+    else:
+        best_move_id = next((move_id for move_id, iterations, stats in results if move_id is not None), None)
+    best_move = next((move for move in valid_moves if move.moveID == best_move_id), None)
+    search_stats.finish(nodes_searched)
+    return_queue.put(best_move)
+    return best_move, search_stats
+
+search_pool = None
+search_pool_workers = 0
+search_pool_stop = None
+
+def get_search_pool(workers, stop=None):
+    # the pool is kept between moves so workers start once and keep their transposition tables warm, a pool
+    # with more workers than asked for is kept as well and only gets fewer searches.
+    # stop has to be shareable between processes (see ai_worker.SearchControl), it is handed to the
+    # workers as they start since it can't be sent with every search.
+    global search_pool, search_pool_workers, search_pool_stop
+    if search_pool is None or search_pool_workers < workers or search_pool_stop is not stop:
+        if search_pool is not None:
+            search_pool.shutdown()
+        search_pool = ProcessPoolExecutor(workers, initializer=set_pool_stop, initargs=(stop,))
+        search_pool_workers = workers
+        search_pool_stop = stop
+    return search_pool
+
+def set_pool_stop(stop):
+    global search_pool_stop
+    search_pool_stop = stop
+
+def search_root_moves(gs, move_ids, time_limit_ms, node_limit, max_depth):
+    global stats_stream
+    # the stats go back to the parent which writes the merged ones
+    stats_stream = None
+    valid_moves = [move for move in gs.get_valid_moves() if move.moveID in move_ids]
+    best_move, iterations = iterative_deepening(gs, valid_moves, time_limit_ms, node_limit, max_depth,
+                                                stop=search_pool_stop, root_share=True)
+    # the root entry only covers this worker's share of the moves, it must not be reused for the whole position
+    transposition_table.discard(gs.zobrist_key)
+    return (best_move.moveID if best_move is not None else None,
+            [(depth, score, move.moveID) for depth, score, move in iterations], search_stats)
+
+def check_limits():
+    global search_aborted
+    if search_node_limit is not None and nodes_searched >= search_node_limit:
+        search_aborted = True
+    elif nodes_searched & CHECK_INTERVAL == 0:
+        if search_deadline is not None and time.perf_counter() >= search_deadline:
+            search_aborted = True
+        elif search_stop is not None and search_stop.is_set():
+            search_aborted = True
+
+def negamax_alphabeta_algo(gs, valid_moves, depth, alpha, beta, turn_multiplier, ply=0, allow_null=True):
+    global next_move, nodes_searched
+    nodes_searched += 1
+    check_limits()
+    if search_aborted:
+        return 0
+    # a repeated position is a draw as far as the search goes: whatever line repeats it once can repeat
+    # it again. The root is exempt so there is always a move.
+    if ply > 0 and gs.is_repetition():
+        return STALEMATE
+    if depth == 0 and use_quiescence:
+        return quiescence(gs, alpha, beta, turn_multiplier, ply)
+    if ply > 0 and gs.halfmove_clock >= engine.FIFTY_MOVE_PLIES:
+        # checkmate on the move that reaches the fifty still wins
+        gs.get_valid_moves()
+        return -CHECKMATE + ply if gs.checkmate else STALEMATE
+
+    # the table is probed before any moves are generated so a cutoff costs no move generation. Mates,
+    # stalemates and bitbase positions are never stored so they are still found below.
+    alpha_orig = alpha
+    tt_move_id = None
+    search_stats.tt_probes += 1
+    entry = transposition_table.probe(gs.zobrist_key)
+    if entry is not None:
+        search_stats.tt_hits += 1
+        tt_move_id = entry[4]
+        # the root always searches so there is a move to play
+        if ply > 0 and entry[1] >= depth:
+            score = score_from_tt(entry[3], ply)
+            if entry[2] == EXACT:
+                return score
+            if entry[2] == LOWER_BOUND and score >= beta:
+                return score
+            if entry[2] == UPPER_BOUND and score <= alpha:
+                return score
+
+    # the root is handed its moves, everywhere else they are only generated once the node is searched
+    if valid_moves is None:
+        valid_moves = gs.get_valid_moves()
+    if gs.checkmate:
+        return -CHECKMATE + ply
+    if gs.stalemate:
+        return STALEMATE
+    # inside an ending the root is already in, only the leaves are scored from the bitbases so the
+    # search still looks for the quickest way to the mate
+    if ply > 0 and (depth == 0 or not bitbase_root):
+        score = bitbase_score(gs)
+        if score is not None:
+            return score
     if depth == 0:
         return turn_multiplier * score_board(gs)
+    in_check = gs.in_check if ply > 0 else gs.incheck()
+
+    # null move pruning: if passing and searching shallower still gets a score of beta or more, a real
+    # move will too. Not in check, not twice in a row and not with only pawns left, where having to
+    # move can be what loses.
+    if (use_null_move and allow_null and ply > 0 and not in_check and depth > NULL_MOVE_REDUCTION and
+            beta < MATE_THRESHOLD and has_pieces(gs)):
+        gs.make_null_move()
+        score = -negamax_alphabeta_algo(gs, None, depth-1-NULL_MOVE_REDUCTION, -beta, -beta+NULL_WINDOW,
+                                        -turn_multiplier, ply+1, False)
+        gs.undo_null_move()
+        if search_aborted:
+            return 0
+        if score >= beta:
+            return score
+    move_orderer.order_moves(valid_moves, ply, tt_move_id)
 
     max_score = -CHECKMATE
-    for move in valid_moves:
+    best_move = None
+    for i, move in enumerate(valid_moves):
         gs.make_move(move)
-        next_moves = gs.get_valid_moves()
-        score = -negamax_alphabeta_algo(gs, next_moves, depth-1, -beta, -alpha, -turn_multiplier)
+        if i == 0:
+            score = -negamax_alphabeta_algo(gs, None, depth-1, -beta, -alpha, -turn_multiplier, ply+1)
+        else:
+            # late move reductions: quiet moves this far down the ordering rarely turn out best so they
+            # are searched a ply shallower first, and again at full depth only if they beat alpha
+            score = None
+            if (use_late_move_reductions and ply > 0 and i >= LMR_MIN_MOVES and depth >= LMR_MIN_DEPTH and
+                    not in_check and move.piece_captured == "--" and not move.is_pawn_promotion and not gs.incheck()):
+                score = -negamax_alphabeta_algo(gs, None, depth-2, -alpha-NULL_WINDOW, -alpha, -turn_multiplier, ply+1)
+            if score is None or score > alpha:
+                # principal variation search: after the first move the rest only have to be shown to be no
+                # better with a null window, the full window is needed only for one that is
+                if use_pvs:
+                    score = -negamax_alphabeta_algo(gs, None, depth-1, -alpha-NULL_WINDOW, -alpha, -turn_multiplier,
+                                                    ply+1)
+                if not use_pvs or alpha < score < beta:
+                    score = -negamax_alphabeta_algo(gs, None, depth-1, -beta, -alpha, -turn_multiplier, ply+1)
+        gs.undo_move()
+        if search_aborted:
+            return 0
         if score > max_score:
             max_score = score
-            if depth == DEPTH:
+            best_move = move
+            if ply == 0:
                 next_move = move
+        if max_score > alpha:
+            alpha = max_score
+        if alpha >= beta:
+            move_orderer.update(move, depth, ply)
+            search_stats.cutoffs += 1
+            if move is valid_moves[0]:
+                search_stats.first_move_cutoffs += 1
+            break
+
+    if max_score <= alpha_orig:
+        flag = UPPER_BOUND
+    elif max_score >= beta:
+        flag = LOWER_BOUND
+    else:
+        flag = EXACT
+    transposition_table.store(gs.zobrist_key, depth, flag, score_to_tt(max_score, ply),
+                              best_move.moveID if best_move is not None else None)
+    return max_score
+
+def quiescence(gs, alpha, beta, turn_multiplier, ply):
+    # only captures and promotions are searched past the horizon so the score isn't taken in the middle
+    # of an exchange. Out of check the side to move can stand pat on the static score, in check all
+    # evasions are searched.
+    global nodes_searched
+    nodes_searched += 1
+    search_stats.qnodes += 1
+    check_limits()
+    if search_aborted:
+        return 0
+    moves = gs.get_capture_moves()
+    in_check = gs.in_check
+    if gs.checkmate:
+        return -CHECKMATE + ply
+    score = bitbase_score(gs)
+    if score is not None:
+        return score
+    # checking evasions can follow each other without end, past MAX_PLY the static score has to do
+    if ply >= MAX_PLY:
+        return turn_multiplier * score_board(gs)
+    if in_check:
+        max_score = stand_pat = -CHECKMATE
+    else:
+        max_score = stand_pat = turn_multiplier * score_board(gs)
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+    # captures always go in MVV-LVA order here, whatever the orderer does in the main search
+    moves.sort(key=mvv_lva, reverse=True)
+
+    for move in moves:
+        if not in_check:
+            # delta pruning: skip captures that can't get back to alpha even winning the piece for free
+            gain = piece_centipawns[move.piece_captured[1]] if move.piece_captured != "--" else 0
+            if move.is_pawn_promotion:
+                gain += piece_centipawns[move.promotion_piece] - piece_centipawns["p"]
+            if stand_pat + gain + DELTA_MARGIN <= alpha:
+                continue
+        gs.make_move(move)
+        score = -quiescence(gs, -beta, -alpha, -turn_multiplier, ply+1)
         gs.undo_move()
+        if search_aborted:
+            return 0
+        if score > max_score:
+            max_score = score
         if max_score > alpha:
             alpha = max_score
         if alpha >= beta:
@@ -98,19 +696,56 @@ def score_board(gs):
     elif gs.stalemate:
         return STALEMATE
 
-    score = 0
-    for row in range(len(gs.board)):
-        for col in range(len(gs.board[row])):
-            piece = gs.board[row][col]
-            if piece != "--":
-                piece_position_score = 0
-                if piece[1] != "k":
-                    piece_position_score = 0
-                if piece[0] == "w":
-                    score += piece_score[piece[1]] + piece_position_score
-                if piece[0] == "b":
-                    score -= piece_score[piece[1]] + piece_position_score
-    return score
+    # material and piece-square values are kept up to date by make_move/undo_move
+    return gs.evaluation
+
+# int8 codes used to encode boards for score_boards, 0 is an empty square
+PIECE_CODES = {"--": 0}
+PIECE_CODES.update({piece: i + 1 for i, piece in enumerate(engine.PIECES)})
+
+def load_numpy():
+    global np, code_scores, square_indices, piece_codes
+    if np is not None:
+        return
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("score_boards requires numpy")
+    # row per piece code, column per square, in hundredths of a pawn like square_scores
+    code_scores = numpy.zeros((len(PIECE_CODES), 64), dtype=numpy.int32)
+    for piece, code in PIECE_CODES.items():
+        if piece != "--":
+            code_scores[code] = square_scores[piece]
+    square_indices = numpy.arange(64)
+    piece_codes = numpy.arange(1, len(engine.PIECES) + 1, dtype=numpy.int8).reshape(1, -1, 1)
+    np = numpy
+
+def encode_boards(positions):
+    # GameStates or 8x8 board lists -> (N, 64) int8 array of piece codes
+    load_numpy()
+    positions = list(positions)
+    if all(isinstance(position, engine.GameState) for position in positions):
+        # unpack the twelve piece bitboards of every position in one go
+        bitboards = np.array([[position.bitboards[piece] for piece in engine.PIECES] for position in positions],
+                             dtype="<u8").reshape(-1, len(engine.PIECES))
+        bits = np.unpackbits(bitboards.view(np.uint8), bitorder="little").reshape(len(positions), len(engine.PIECES), 64)
+        return (bits * piece_codes).sum(axis=1, dtype=np.int8)
+    codes = [PIECE_CODES[piece] for position in positions
+             for row in (position.board if isinstance(position, engine.GameState) else position) for piece in row]
+    return np.array(codes, dtype=np.int8).reshape(-1, 64)
+
+def score_boards(positions):
+    # vectorised score_board for many positions at once: GameStates, 8x8 board lists or an already
+    # encoded (N, 64) int8 array. GameStates also get their checkmate/stalemate scores.
+    load_numpy()
+    if isinstance(positions, np.ndarray):
+        return code_scores[positions, square_indices].sum(axis=1)
+    positions = list(positions)
+    scores = code_scores[encode_boards(positions), square_indices].sum(axis=1)
+    for i, position in enumerate(positions):
+        if isinstance(position, engine.GameState) and (position.checkmate or position.stalemate):
+            scores[i] = score_board(position)
+    return scores
 
 def find_random_move(valid_moves):
     return random.choice(valid_moves)
\ No newline at end of file
@@ -1,5 +1,202 @@
+import random
+
+# Squares are indexed 0-63 as row * 8 + col, with row 0 being the 8th rank just like the board list.
+# Bit n of a bitboard is set when square n is occupied/attacked.
+
+SQUARE_COORDS = [(sq >> 3, sq & 7) for sq in range(64)]
+
+# same order as the directions used by pins_and_checks: 4 orthogonal followed by 4 diagonal
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+DIRECTION_INDEX = {d: i for i, d in enumerate(DIRECTIONS)}
+ROOK_DIRECTIONS = (0, 1, 2, 3)
+BISHOP_DIRECTIONS = (4, 5, 6, 7)
+# directions walking towards higher square indices find their nearest blocker with the lowest set bit
+POSITIVE_DIRECTION = [d[0] * 8 + d[1] > 0 for d in DIRECTIONS]
+
+
+def build_step_attacks(offsets):
+    table = []
+    for r, c in SQUARE_COORDS:
+        attacks = 0
+        for dr, dc in offsets:
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                attacks |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(attacks)
+    return table
+
+
+def build_rays():
+    rays = []
+    for dr, dc in DIRECTIONS:
+        table = []
+        for r, c in SQUARE_COORDS:
+            ray = 0
+            end_row, end_col = r + dr, c + dc
+            while 0 <= end_row < 8 and 0 <= end_col < 8:
+                ray |= 1 << (end_row * 8 + end_col)
+                end_row += dr
+                end_col += dc
+            table.append(ray)
+        rays.append(table)
+    return rays
+
+
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KNIGHT_ATTACKS = build_step_attacks(KNIGHT_OFFSETS)
+KING_ATTACKS = build_step_attacks(DIRECTIONS)
+# squares a pawn of the given colour attacks from each square
+PAWN_ATTACKS = {"w": build_step_attacks(((-1, -1), (-1, 1))), "b": build_step_attacks(((1, -1), (1, 1)))}
+RAYS = build_rays()
+OPPOSITE_DIRECTION = [DIRECTION_INDEX[(-dr, -dc)] for dr, dc in DIRECTIONS]
+# both rays through a square along a direction, used to keep pinned pieces on their pin line
+LINES = [[RAYS[i][sq] | RAYS[OPPOSITE_DIRECTION[i]][sq] for sq in range(64)] for i in range(8)]
+SLIDER_DIRECTIONS = {"b": BISHOP_DIRECTIONS, "r": ROOK_DIRECTIONS, "q": ROOK_DIRECTIONS + BISHOP_DIRECTIONS}
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+ALL_SQUARES = (1 << 64) - 1
+RANK_MASKS = [0xFF << (8 * r) for r in range(8)]  # indexed by board row
+FILE_MASKS = [0x0101010101010101 << c for c in range(8)]
+PIECES = ("wp", "wn", "wb", "wr", "wq", "wk", "bp", "bn", "bb", "br", "bq", "bk")
+FIFTY_MOVE_PLIES = 100  # halfmove clock at which the game is drawn by the fifty-move rule
+
+# castling rights are a 4 bit mask
+WHITE_KINGSIDE = 1
+BLACK_KINGSIDE = 2
+WHITE_QUEENSIDE = 4
+BLACK_QUEENSIDE = 8
+ALL_CASTLING = 15
+CASTLING_FEN = (("K", WHITE_KINGSIDE), ("Q", WHITE_QUEENSIDE), ("k", BLACK_KINGSIDE), ("q", BLACK_QUEENSIDE))
+# king and rook each right needs on their home squares
+CASTLING_PIECES = ((WHITE_KINGSIDE, 60, "wk", 63, "wr"), (WHITE_QUEENSIDE, 60, "wk", 56, "wr"),
+                   (BLACK_KINGSIDE, 4, "bk", 7, "br"), (BLACK_QUEENSIDE, 4, "bk", 0, "br"))
+# rights kept when a move starts or ends on a square, so moving a king or rook (or capturing a rook) is one AND
+CASTLING_MASKS = [ALL_CASTLING] * 64
+CASTLING_MASKS[60] = ALL_CASTLING & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASKS[63] = ALL_CASTLING & ~WHITE_KINGSIDE
+CASTLING_MASKS[56] = ALL_CASTLING & ~WHITE_QUEENSIDE
+CASTLING_MASKS[4] = ALL_CASTLING & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASKS[7] = ALL_CASTLING & ~BLACK_KINGSIDE
+CASTLING_MASKS[0] = ALL_CASTLING & ~BLACK_QUEENSIDE
+
+
+# evaluation: material in pawns and positional bonus by square for each piece
+piece_score = {"k": 0, "q": 10, "r": 5, "b": 3, "n": 3, "p": 1}
+
+knight_scores = [[0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0],
+                 [0.1, 0.3, 0.5, 0.5, 0.5, 0.5, 0.3, 0.1],
+                 [0.2, 0.5, 0.6, 0.65, 0.65, 0.6, 0.5, 0.2],
+                 [0.2, 0.55, 0.65, 0.7, 0.7, 0.65, 0.55, 0.2],
+                 [0.2, 0.5, 0.65, 0.7, 0.7, 0.65, 0.5, 0.2],
+                 [0.2, 0.55, 0.6, 0.65, 0.65, 0.6, 0.55, 0.2],
+                 [0.1, 0.3, 0.5, 0.55, 0.55, 0.5, 0.3, 0.1],
+                 [0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0]]
+
+bishop_scores = [[0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
+                 [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
+                 [0.2, 0.4, 0.5, 0.6, 0.6, 0.5, 0.4, 0.2],
+                 [0.2, 0.5, 0.5, 0.6, 0.6, 0.5, 0.5, 0.2],
+                 [0.2, 0.4, 0.6, 0.6, 0.6, 0.6, 0.4, 0.2],
+                 [0.2, 0.6, 0.6, 0.6, 0.6, 0.6, 0.6, 0.2],
+                 [0.2, 0.5, 0.4, 0.4, 0.4, 0.4, 0.5, 0.2],
+                 [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0]]
+
+rook_scores = [[0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25],
+               [0.5, 0.75, 0.75, 0.75, 0.75, 0.75, 0.75, 0.5],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.25, 0.25, 0.25, 0.5, 0.5, 0.25, 0.25, 0.25]]
+
+queen_scores = [[0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0],
+                [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
+                [0.2, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
+                [0.3, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
+                [0.4, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
+                [0.2, 0.5, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
+                [0.2, 0.4, 0.5, 0.4, 0.4, 0.4, 0.4, 0.2],
+                [0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0]]
+
+pawn_scores = [[0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8],
+               [0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7],
+               [0.3, 0.3, 0.4, 0.5, 0.5, 0.4, 0.3, 0.3],
+               [0.25, 0.25, 0.3, 0.9, 0.85, 0.3, 0.25, 0.25],
+               [0.2, 0.2, 0.2, 0.85, 0.9, 0.2, 0.2, 0.2],
+               [0.25, 0.15, 0.1, 0.2, 0.2, 0.1, 0.15, 0.25],
+               [0.25, 0.3, 0.3, 0.0, 0.0, 0.3, 0.3, 0.25],
+               [0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2]]
+
+piece_position_scores = {"wn": knight_scores,
+                         "bn": knight_scores[::-1],
+                         "wb": bishop_scores,
+                         "bb": bishop_scores[::-1],
+                         "wq": queen_scores,
+                         "bq": queen_scores[::-1],
+                         "wr": rook_scores,
+                         "br": rook_scores[::-1],
+                         "wp": pawn_scores,
+                         "bp": pawn_scores[::-1]}
+
+
+def build_square_scores():
+    # material plus piece-square value for every piece on every square, from white's point of view
+    # and in hundredths of a pawn so the incremental sums in GameState stay exact
+    square_scores = {}
+    for piece in PIECES:
+        sign = 1 if piece[0] == "w" else -1
+        position_scores = piece_position_scores.get(piece)
+        square_scores[piece] = [sign * round(100 * (piece_score[piece[1]] + (position_scores[r][c] if position_scores else 0)))
+                                for r, c in SQUARE_COORDS]
+    return square_scores
+
+
+SQUARE_SCORES = build_square_scores()
+
+
+# fixed seed so keys (and anything keyed by them) are the same in every process
+zobrist_random = random.Random(20240601)
+ZOBRIST_PIECES = {piece: [zobrist_random.getrandbits(64) for sq in range(64)] for piece in PIECES}
+ZOBRIST_BLACK_TO_MOVE = zobrist_random.getrandbits(64)
+ZOBRIST_CASTLING = [zobrist_random.getrandbits(64) for i in range(4)]  # w_kingside, b_kingside, w_queenside, b_queenside
+ZOBRIST_EN_PASSANT = [zobrist_random.getrandbits(64) for col in range(8)]
+# key of every castling mask, the XOR of the keys of its rights
+ZOBRIST_CASTLING_MASKS = [0] * 16
+for castling in range(16):
+    for i in range(4):
+        if castling & (1 << i):
+            ZOBRIST_CASTLING_MASKS[castling] ^= ZOBRIST_CASTLING[i]
+
+
+def slider_attacks(sq, occupied, directions):
+    attacks = 0
+    for d in directions:
+        ray = RAYS[d][sq]
+        blockers = ray & occupied
+        if blockers:
+            if POSITIVE_DIRECTION[d]:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= RAYS[d][blocker]
+        attacks |= ray
+    return attacks
+
+
+def first_blocker(sq, occupied, d):
+    blockers = RAYS[d][sq] & occupied
+    if not blockers:
+        return -1
+    if POSITIVE_DIRECTION[d]:
+        return (blockers & -blockers).bit_length() - 1
+    return blockers.bit_length() - 1
+
+
 class GameState():
-    def __init__(self):
+    # piece -> white point of view score of that piece on each square in hundredths of a pawn,
+    # summed incrementally into self.evaluation by put_piece/remove_piece
+    square_scores = SQUARE_SCORES
+
+    def __init__(self, fen=None):
         self.board = [
         ["br", "bn", "bb", "bq", "bk", "bb", "bn", "br"],
         ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
@@ -20,53 +217,216 @@ class GameState():
         self.in_check = False
         self.checkmate = False
         self.stalemate = False
-        self.pins = []
-        self.checks = []
-        self.en_passant_possible = ()
-        self.current_castling_rights = CastleRights(True, True, True, True)
-        self.castle_rights_log = [CastleRights(self.current_castling_rights.w_kingside, self.current_castling_rights.b_kingside,
-                                               self.current_castling_rights.w_queenside, self.current_castling_rights.b_queenside)]
+        self.pin_masks = {}
+        self.check_mask = ALL_SQUARES
+        self.en_passant_square = None
+        self.castling = ALL_CASTLING
+        self.halfmove_clock = 0
+        self.first_move_number = 1  # fullmove number of the position the game started from
+        # irreversible state from before each move in move_log: (castling, en_passant_square, halfmove_clock, zobrist_key)
+        self.state_log = []
+        self.init_bitboards()
+        self.zobrist_key = self.compute_zobrist_key()
+        # how often each position of the game so far has been on the board, by zobrist key. Positions from
+        # before the last pawn move, capture or loss of castling rights can't come back, so counting them
+        # too costs nothing and spares looking back to the last irreversible move.
+        self.repetitions = {self.zobrist_key: 1}
+        self.evaluation = self.compute_evaluation()
+        if fen is not None:
+            self.load_fen(fen)
+
+    def load_fen(self, fen):
+        fields = fen.split()
+        self.board = [["--"] * 8 for r in range(8)]
+        for r, rank in enumerate(fields[0].split("/")):
+            c = 0
+            for char in rank:
+                if char.isdigit():
+                    c += int(char)
+                else:
+                    piece = ("w" if char.isupper() else "b") + char.lower()
+                    self.board[r][c] = piece
+                    if piece == "wk":
+                        self.white_king_location = (r, c)
+                    elif piece == "bk":
+                        self.black_king_location = (r, c)
+                    c += 1
+        self.white_to_move = fields[1] == "w"
+        castling = fields[2] if len(fields) > 2 else "-"
+        self.castling = 0
+        for char, right in CASTLING_FEN:
+            if char in castling:
+                self.castling |= right
+        # a right whose king or rook isn't at home can't be used whatever the FEN says
+        for right, king_sq, king, rook_sq, rook in CASTLING_PIECES:
+            if self.board[king_sq >> 3][king_sq & 7] != king or self.board[rook_sq >> 3][rook_sq & 7] != rook:
+                self.castling &= ~right
+        en_passant = fields[3] if len(fields) > 3 else "-"
+        if en_passant == "-":
+            self.en_passant_square = None
+        else:
+            self.en_passant_square = Move.ranks_to_rows[en_passant[1]] * 8 + Move.files_to_cols[en_passant[0]]
+        self.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        self.first_move_number = int(fields[5]) if len(fields) > 5 else 1
+        self.state_log = []
+        self.move_log = []
+        self.in_check = False
+        self.checkmate = False
+        self.stalemate = False
+        self.init_bitboards()
+        if self.en_passant_square is not None and not self.can_capture_en_passant(self.en_passant_square):
+            self.en_passant_square = None
+        self.zobrist_key = self.compute_zobrist_key()
+        self.repetitions = {self.zobrist_key: 1}
+        self.evaluation = self.compute_evaluation()
+
+    def get_fen(self):
+        rows = []
+        for row in self.board:
+            fen_row = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    fen_row += str(empty)
+                    empty = 0
+                fen_row += piece[1].upper() if piece[0] == "w" else piece[1]
+            rows.append(fen_row + (str(empty) if empty else ""))
+        castling = "".join(char for char, right in CASTLING_FEN if self.castling & right) or "-"
+        if self.en_passant_square is None:
+            en_passant = "-"
+        else:
+            en_passant = Move.cols_to_files[self.en_passant_square & 7] + Move.rows_to_ranks[self.en_passant_square >> 3]
+        # the fullmove number goes up after every black move since the starting position
+        plies = len(self.move_log)
+        started_with_black = self.white_to_move != (plies % 2 == 0)
+        fullmove_number = self.first_move_number + (plies + started_with_black) // 2
+        return "{} {} {} {} {} {}".format("/".join(rows), "w" if self.white_to_move else "b", castling, en_passant,
+                                          self.halfmove_clock, fullmove_number)
+
+    def init_bitboards(self):
+        self.bitboards = {piece: 0 for piece in PIECES}
+        self.occupancy = {"w": 0, "b": 0}
+        self.all_occupancy = 0
+        for sq in range(64):
+            piece = self.board[sq >> 3][sq & 7]
+            if piece != "--":
+                self.bitboards[piece] |= 1 << sq
+                self.occupancy[piece[0]] |= 1 << sq
+        self.all_occupancy = self.occupancy["w"] | self.occupancy["b"]
+
+    def can_capture_en_passant(self, sq):
+        # the en passant square is only kept, and hashed, when a pawn of the side to move is next to the
+        # pawn that passed it. Otherwise the position is the same as one reached any other way and has to
+        # have the same key for repetitions to be seen.
+        enemy_color = "b" if self.white_to_move else "w"
+        ally_color = "w" if self.white_to_move else "b"
+        return bool(PAWN_ATTACKS[enemy_color][sq] & self.bitboards[ally_color + "p"])
+
+    def compute_zobrist_key(self):
+        key = 0
+        for sq in range(64):
+            piece = self.board[sq >> 3][sq & 7]
+            if piece != "--":
+                key ^= ZOBRIST_PIECES[piece][sq]
+        if not self.white_to_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING_MASKS[self.castling]
+        if self.en_passant_square is not None:
+            key ^= ZOBRIST_EN_PASSANT[self.en_passant_square & 7]
+        return key
+
+    def compute_evaluation(self):
+        evaluation = 0
+        for sq in range(64):
+            piece = self.board[sq >> 3][sq & 7]
+            if piece != "--":
+                evaluation += self.square_scores[piece][sq]
+        return evaluation
+
+    def put_piece(self, sq, piece):
+        bit = 1 << sq
+        self.zobrist_key ^= ZOBRIST_PIECES[piece][sq]
+        self.evaluation += self.square_scores[piece][sq]
+        self.board[sq >> 3][sq & 7] = piece
+        self.bitboards[piece] |= bit
+        self.occupancy[piece[0]] |= bit
+        self.all_occupancy |= bit
+
+    def remove_piece(self, sq):
+        piece = self.board[sq >> 3][sq & 7]
+        if piece != "--":
+            bit = ~(1 << sq)
+            self.zobrist_key ^= ZOBRIST_PIECES[piece][sq]
+            self.evaluation -= self.square_scores[piece][sq]
+            self.board[sq >> 3][sq & 7] = "--"
+            self.bitboards[piece] &= bit
+            self.occupancy[piece[0]] &= bit
+            self.all_occupancy &= bit
+        return piece
 
     def make_move(self, move):
-        self.board[move.start_row][move.start_col] = "--"
-        self.board[move.end_row][move.end_col] = move.piece_moved
+        start = move.start_sq
+        end = move.end_sq
+        self.state_log.append((self.castling, self.en_passant_square, self.halfmove_clock, self.zobrist_key))
+        self.remove_piece(start)
+        self.remove_piece(end)
+        if move.is_pawn_promotion:
+            self.put_piece(end, move.piece_moved[0] + move.promotion_piece)
+        else:
+            self.put_piece(end, move.piece_moved)
         self.move_log.append(move)
         self.white_to_move = not self.white_to_move
+        self.zobrist_key ^= ZOBRIST_BLACK_TO_MOVE
         if move.piece_moved == "wk":
             self.white_king_location = (move.end_row, move.end_col)
         elif move.piece_moved == "bk":
             self.black_king_location = (move.end_row, move.end_col)
 
-        if move.is_pawn_promotion:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + "q"
-
         if move.is_en_passant:
-            self.board[move.start_row][move.end_col] = "--"
+            self.remove_piece(move.start_row * 8 + move.end_col)
+
+        if self.en_passant_square is not None:
+            self.zobrist_key ^= ZOBRIST_EN_PASSANT[self.en_passant_square & 7]
+        self.en_passant_square = None
+        if move.piece_moved[1] == "p" and abs(start - end) == 16 and self.can_capture_en_passant((start + end) >> 1):
+            self.en_passant_square = (start + end) >> 1
+            self.zobrist_key ^= ZOBRIST_EN_PASSANT[move.start_col]
 
-        if move.piece_moved[1] == "p" and abs(move.start_row - move.end_row) == 2:
-            self.en_passant_possible = ((move.start_row + move.end_row)//2, move.start_col)
+        if move.piece_moved[1] == "p" or move.piece_captured != "--":
+            self.halfmove_clock = 0
         else:
-            self.en_passant_possible = ()
+            self.halfmove_clock += 1
 
         if move.is_castle_move:
             if move.end_col - move.start_col == 2:
-                self.board[move.end_row][move.end_col-1] = self.board[move.end_row][move.end_col+1]
-                self.board[move.end_row][move.end_col+1] = "--"
+                self.put_piece(end - 1, self.remove_piece(end + 1))
             else:
-                self.board[move.end_row][move.end_col+1] = self.board[move.end_row][move.end_col-2]
-                self.board[move.end_row][move.end_col-2] = "--"
-
+                self.put_piece(end + 1, self.remove_piece(end - 2))
 
         #updating castling rights
-        self.update_castle_rights(move)
-        self.castle_rights_log.append(CastleRights(self.current_castling_rights.w_kingside, self.current_castling_rights.b_kingside,
-                                               self.current_castling_rights.w_queenside, self.current_castling_rights.b_queenside))
+        castling = self.castling & CASTLING_MASKS[start] & CASTLING_MASKS[end]
+        if castling != self.castling:
+            self.zobrist_key ^= ZOBRIST_CASTLING_MASKS[self.castling] ^ ZOBRIST_CASTLING_MASKS[castling]
+            self.castling = castling
+        self.repetitions[self.zobrist_key] = self.repetitions.get(self.zobrist_key, 0) + 1
 
     def undo_move(self):
         if len(self.move_log) != 0:
             move = self.move_log.pop()
-            self.board[move.start_row][move.start_col] = move.piece_moved
-            self.board[move.end_row][move.end_col] = move.piece_captured
+            count = self.repetitions[self.zobrist_key]
+            if count == 1:
+                del self.repetitions[self.zobrist_key]
+            else:
+                self.repetitions[self.zobrist_key] = count - 1
+            start = move.start_sq
+            end = move.end_sq
+            self.remove_piece(end)
+            self.put_piece(start, move.piece_moved)
+            if move.piece_captured != "--" and not move.is_en_passant:
+                self.put_piece(end, move.piece_captured)
             self.white_to_move = not self.white_to_move
             if move.piece_moved == "wk":
                 self.white_king_location = (move.start_row, move.start_col)
@@ -74,68 +434,46 @@ class GameState():
                 self.black_king_location = (move.start_row, move.start_col)
 
             if move.is_en_passant:
-                self.board[move.end_row][move.end_col] = "--"
-                self.board[move.start_row][move.end_col] = move.piece_captured
-                self.en_passant_possible = (move.end_row, move.end_col)
-
-            if move.piece_moved[1] == "p" and abs(move.start_row - move.end_row) == 2:
-                self.en_passant_possible = ()
-
-            #undo castling rights
-            self.castle_rights_log.pop()
-            new_rights = self.castle_rights_log[-1]
-            self.current_castling_rights = CastleRights(new_rights.w_kingside, new_rights.b_kingside, new_rights.w_queenside, new_rights.b_queenside)
+                self.put_piece(move.start_row * 8 + move.end_col, move.piece_captured)
 
             #undo castle move
             if move.is_castle_move:
                 if move.end_col - move.start_col == 2:
-                    self.board[move.end_row][move.end_col+1] = self.board[move.end_row][move.end_col-1]
-                    self.board[move.end_row][move.end_col-1] = "--"
+                    self.put_piece(end + 1, self.remove_piece(end - 1))
                 else:
-                    self.board[move.end_row][move.end_col-2] = self.board[move.end_row][move.end_col+1]
-                    self.board[move.end_row][move.end_col+1] = "--"
+                    self.put_piece(end - 2, self.remove_piece(end + 1))
 
+            # castling rights, en passant square, halfmove clock and the key all come straight back off the stack
+            self.castling, self.en_passant_square, self.halfmove_clock, self.zobrist_key = self.state_log.pop()
             self.checkmate = False
             self.stalemate = False
 
-    def update_castle_rights(self, move):
-        if move.piece_moved == "wk":
-            self.current_castling_rights.w_kingside = False
-            self.current_castling_rights.w_queenside = False
-        elif move.piece_moved == "bk":
-            self.current_castling_rights.b_kingside = False
-            self.current_castling_rights.b_queenside = False
-        elif move.piece_moved == "wr":
-            if move.start_row == 7:
-                if move.start_col == 0:
-                    self.current_castling_rights.w_queenside = False
-                elif move.start_col == 7:
-                    self.current_castling_rights.w_kingside = False
-        elif move.piece_moved == "br":
-            if move.start_row == 0:
-                if move.start_col == 0:
-                    self.current_castling_rights.b_queenside = False
-                elif move.start_col == 7:
-                    self.current_castling_rights.b_kingside = False
-
-        if move.piece_captured == "wr":
-            if move.end_row == 7:
-                if move.end_col == 0:
-                    self.current_castling_rights.w_queenside = False
-                elif move.end_col == 7:
-                    self.current_castling_rights.w_kingside = False
-        if move.piece_captured == "br":
-            if move.end_row == 0:
-                if move.end_col == 0:
-                    self.current_castling_rights.b_queenside = False
-                elif move.end_col == 7:
-                    self.current_castling_rights.b_kingside = False
-
-
+    def make_null_move(self):
+        # passes the turn, for null move pruning in the search. Nothing goes on move_log, so it is taken
+        # back with undo_null_move rather than undo_move.
+        self.state_log.append((self.castling, self.en_passant_square, self.halfmove_clock, self.zobrist_key))
+        if self.en_passant_square is not None:
+            self.zobrist_key ^= ZOBRIST_EN_PASSANT[self.en_passant_square & 7]
+            self.en_passant_square = None
+        self.white_to_move = not self.white_to_move
+        self.zobrist_key ^= ZOBRIST_BLACK_TO_MOVE
+        self.halfmove_clock += 1
+        self.repetitions[self.zobrist_key] = self.repetitions.get(self.zobrist_key, 0) + 1
+
+    def undo_null_move(self):
+        count = self.repetitions[self.zobrist_key]
+        if count == 1:
+            del self.repetitions[self.zobrist_key]
+        else:
+            self.repetitions[self.zobrist_key] = count - 1
+        self.white_to_move = not self.white_to_move
+        self.castling, self.en_passant_square, self.halfmove_clock, self.zobrist_key = self.state_log.pop()
+        self.checkmate = False
+        self.stalemate = False
 
     def get_valid_moves(self):
         moves = []
-        self.in_check, self.pins, self.checks = self.pins_and_checks()
+        self.in_check, self.pin_masks, self.check_mask = self.pins_and_checks()
         if self.white_to_move:
             king_row = self.white_king_location[0]
             king_col = self.white_king_location[1]
@@ -143,33 +481,15 @@ class GameState():
             king_row = self.black_king_location[0]
             king_col = self.black_king_location[1]
         if self.in_check:
-            if len(self.checks) == 1:
+            if self.check_mask:
+                # the generators only produce moves that capture or block the checking piece
                 moves = self.get_all_moves()
-                check = self.checks[0]
-                check_row = check[0]
-                check_col = check[1]
-                piece_attacking = self.board[check_row][check_col]
-                valid_squares = []
-                if piece_attacking[1] == "n":
-                    valid_squares = [(check_row, check_col)]
-                else:
-                    for i in range(1,8):
-                        valid_square = (king_row + check[2] * i, king_col + check[3] * i)
-                        valid_squares.append(valid_square)
-                        if valid_square[0] == check_row and valid_square[1] == check_col:
-                            break
-                for i in range(len(moves) - 1, -1, -1):
-                    if moves[i].piece_moved[1] != "k":
-                        if not (moves[i].end_row, moves[i].end_col) in valid_squares:
-                            moves.remove(moves[i])
             else:
+                # double check, only the king can move
                 self.get_king_moves(king_row, king_col, moves)
         else:
             moves = self.get_all_moves()
-            if self.white_to_move:
-                self.get_castle_moves(self.white_king_location[0], self.white_king_location[1], moves)
-            else:
-                self.get_castle_moves(self.black_king_location[0], self.black_king_location[1], moves)
+            self.get_castle_moves(king_row, king_col, moves)
 
         if len(moves) == 0:
             if self.incheck():
@@ -182,6 +502,15 @@ class GameState():
 
         return moves
 
+    def is_repetition(self):
+        # the position has been on the board before, which the search scores as a draw right away
+        return self.repetitions[self.zobrist_key] > 1
+
+    def is_draw(self):
+        # threefold repetition or fifty moves without a pawn move or capture, checkmate on the move that
+        # reaches the fifty still wins so this goes after get_valid_moves
+        return (self.repetitions[self.zobrist_key] >= 3 or self.halfmove_clock >= FIFTY_MOVE_PLIES) and not self.checkmate
+
     def incheck(self):
         if self.white_to_move:
             return self.square_under_attack(self.white_king_location[0], self.white_king_location[1])
@@ -189,301 +518,319 @@ class GameState():
             return self.square_under_attack(self.black_king_location[0], self.black_king_location[1])
 
     def square_under_attack(self, row, col):
-        self.white_to_move = not self.white_to_move  # switch to opponent's point of view
-        opponents_moves = self.get_all_moves()
-        self.white_to_move = not self.white_to_move
-        for move in opponents_moves:
-            if move.end_row == row and move.end_col == col:  # square is under attack
-                return True
-        return False
+        return self.is_attacked(row * 8 + col, "b" if self.white_to_move else "w", self.all_occupancy)
+
+    def is_attacked(self, sq, enemy_color, occupied):
+        # looks outwards from the square for each kind of attacker instead of generating the enemy's moves,
+        # cheap lookups first
+        ally_color = "b" if enemy_color == "w" else "w"
+        if KNIGHT_ATTACKS[sq] & self.bitboards[enemy_color + "n"]:
+            return True
+        if PAWN_ATTACKS[ally_color][sq] & self.bitboards[enemy_color + "p"]:
+            return True
+        if KING_ATTACKS[sq] & self.bitboards[enemy_color + "k"]:
+            return True
+        queens = self.bitboards[enemy_color + "q"]
+        if slider_attacks(sq, occupied, ROOK_DIRECTIONS) & (self.bitboards[enemy_color + "r"] | queens):
+            return True
+        return bool(slider_attacks(sq, occupied, BISHOP_DIRECTIONS) & (self.bitboards[enemy_color + "b"] | queens))
 
     def get_all_moves(self):
         moves = []
-        for r in range(len(self.board)):
-            for c in range(len(self.board[r])):
-                turn = self.board[r][c][0]
-                piece = self.board[r][c][1]
-                if (turn == "w" and self.white_to_move) or (turn == "b" and not self.white_to_move):
-                    self.move_function[piece](r, c, moves)
+        ally = "w" if self.white_to_move else "b"
+        self.get_all_pawn_moves(moves)
+        for piece in "nbrqk":
+            bitboard = self.bitboards[ally + piece]
+            while bitboard:
+                bit = bitboard & -bitboard
+                bitboard ^= bit
+                r, c = SQUARE_COORDS[bit.bit_length() - 1]
+                self.move_function[piece](r, c, moves)
+        return moves
+
+    def get_capture_moves(self):
+        # legal captures and promotions only, for the quiescence search. In check every evasion is returned
+        # instead (through get_valid_moves, which also sets checkmate), so callers should look at in_check.
+        self.in_check, self.pin_masks, self.check_mask = self.pins_and_checks()
+        if self.in_check:
+            return self.get_valid_moves()
+        moves = []
+        ally, enemy_color = ("w", "b") if self.white_to_move else ("b", "w")
+        enemy = self.occupancy[enemy_color]
+        free, single_moves = self.split_pawns(ally, enemy_color)
+        empty = ~self.all_occupancy & ALL_SQUARES
+        if self.white_to_move:
+            self.add_pawn_moves((free >> 8) & empty & RANK_MASKS[0], 8, moves)
+            self.add_pawn_moves(((free & ~FILE_MASKS[0]) >> 9) & enemy, 9, moves)
+            self.add_pawn_moves(((free & ~FILE_MASKS[7]) >> 7) & enemy, 7, moves)
+        else:
+            self.add_pawn_moves((free << 8) & empty & RANK_MASKS[7], -8, moves)
+            self.add_pawn_moves(((free & ~FILE_MASKS[0]) << 7) & enemy, -7, moves)
+            self.add_pawn_moves(((free & ~FILE_MASKS[7]) << 9) & enemy, -9, moves)
+        while single_moves:
+            bit = single_moves & -single_moves
+            single_moves ^= bit
+            r, c = SQUARE_COORDS[bit.bit_length() - 1]
+            pawn_moves = []
+            self.get_pawn_moves(r, c, pawn_moves)
+            moves.extend(move for move in pawn_moves if move.piece_captured != "--" or move.is_pawn_promotion)
+
+        for piece in "nbrq":
+            bitboard = self.bitboards[ally + piece]
+            while bitboard:
+                bit = bitboard & -bitboard
+                bitboard ^= bit
+                sq = bit.bit_length() - 1
+                if piece == "n":
+                    if sq in self.pin_masks:
+                        continue
+                    targets = KNIGHT_ATTACKS[sq]
+                else:
+                    targets = slider_attacks(sq, self.all_occupancy, SLIDER_DIRECTIONS[piece])
+                self.add_moves(sq, targets & enemy & self.pin_masks.get(sq, ALL_SQUARES), moves)
+
+        king_sq = self.bitboards[ally + "k"].bit_length() - 1
+        targets = KING_ATTACKS[king_sq] & enemy
+        occupied = self.all_occupancy & ~(1 << king_sq)
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            end = bit.bit_length() - 1
+            if not self.is_attacked(end, enemy_color, occupied):
+                moves.append(Move.from_squares(king_sq, end, self.board))
         return moves
 
     def pins_and_checks(self):
-        pins = []  # squares pinned and the direction its pinned from
-        checks = []  # squares where enemy is applying a check
-        in_check = False
+        # returns whether the side to move is in check, the squares each pinned piece may move to keyed by
+        # its square, and the squares any other non-king move has to land on: the whole board out of check,
+        # the checker and the squares between it and the king in check, nothing in double check
+        pin_lines = {}
+        check_mask = ALL_SQUARES
+        checks = 0
         if self.white_to_move:
             enemy_color = "b"
             ally_color = "w"
-            start_row = self.white_king_location[0]
-            start_col = self.white_king_location[1]
+            king_sq = self.white_king_location[0] * 8 + self.white_king_location[1]
         else:
             enemy_color = "w"
             ally_color = "b"
-            start_row = self.black_king_location[0]
-            start_col = self.black_king_location[1]
-        # check outwards from king for pins and checks, keep track of pins
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            direction = directions[j]
-            possible_pin = ()  # reset possible pins
-            for i in range(1, 8):
-                end_row = start_row + direction[0] * i
-                end_col = start_col + direction[1] * i
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] == ally_color and end_piece[1] != "k":
-                        if possible_pin == ():  # first allied piece could be pinned
-                            possible_pin = (end_row, end_col, direction[0], direction[1])
-                        else:  # 2nd allied piece - no check or pin from this direction
-                            break
-                    elif end_piece[0] == enemy_color:
-                        enemy_type = end_piece[1]
-                        # 5 possibilities in this complex conditional
-                        # 1.) orthogonally away from king and piece is a rook
-                        # 2.) diagonally away from king and piece is a bishop
-                        # 3.) 1 square away diagonally from king and piece is a pawn
-                        # 4.) any direction and piece is a queen
-                        # 5.) any direction 1 square away and piece is a king
-                        if (0 <= j <= 3 and enemy_type == "r") or (4 <= j <= 7 and enemy_type == "b") or (
-                                i == 1 and enemy_type == "p" and (
-                                (enemy_color == "w" and 6 <= j <= 7) or (enemy_color == "b" and 4 <= j <= 5))) or (
-                                enemy_type == "q") or (i == 1 and enemy_type == "k"):
-                            if possible_pin == ():  # no piece blocking, so check
-                                in_check = True
-                                checks.append((end_row, end_col, direction[0], direction[1]))
-                                break
-                            else:  # piece blocking so pin
-                                pins.append(possible_pin)
-                                break
-                        else:  # enemy piece not applying checks
-                            break
-                else:
-                    break  # off board
-        # check for knight checks
-        knight_moves = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2))
-        for move in knight_moves:
-            end_row = start_row + move[0]
-            end_col = start_col + move[1]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] == enemy_color and end_piece[1] == "n":  # enemy knight attacking a king
-                    in_check = True
-                    checks.append((end_row, end_col, move[0], move[1]))
-        return in_check, pins, checks
-
+            king_sq = self.black_king_location[0] * 8 + self.black_king_location[1]
+        # the king is left out of the occupancy so a king stepping along a checking line still sees the check
+        king = self.bitboards[ally_color + "k"]
+        occupied = self.all_occupancy & ~king
+        allies = self.occupancy[ally_color] & ~king
+        queens = self.bitboards[enemy_color + "q"]
+        orthogonal = self.bitboards[enemy_color + "r"] | queens
+        diagonal = self.bitboards[enemy_color + "b"] | queens
+        # check outwards from king for pins and checks
+        for j in range(8):
+            blocker = first_blocker(king_sq, occupied, j)
+            if blocker == -1:
+                continue
+            sliders = orthogonal if j < 4 else diagonal
+            if (sliders >> blocker) & 1:
+                checks += 1
+                check_mask = RAYS[j][king_sq] ^ RAYS[j][blocker]
+            elif (allies >> blocker) & 1:
+                # first allied piece could be pinned if an enemy slider is right behind it
+                pinner = first_blocker(blocker, occupied, j)
+                if pinner != -1 and (sliders >> pinner) & 1:
+                    pin_lines[blocker] = LINES[j][blocker]
+        # pawn and knight checks are a single lookup from the king square
+        attackers = (PAWN_ATTACKS[ally_color][king_sq] & self.bitboards[enemy_color + "p"]) | \
+                    (KNIGHT_ATTACKS[king_sq] & self.bitboards[enemy_color + "n"])
+        if attackers:
+            checks += 1 if attackers & (attackers - 1) == 0 else 2
+            check_mask = attackers
+        if checks > 1:
+            check_mask = 0
+        for sq in pin_lines:
+            pin_lines[sq] &= check_mask
+        return checks > 0, pin_lines, check_mask
+
+    def add_moves(self, sq, targets, moves):
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            moves.append(Move.from_squares(sq, bit.bit_length() - 1, self.board))
 
     def get_pawn_moves(self, r, c, moves):
-        pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-
+        sq = r * 8 + c
+        allowed = self.pin_masks.get(sq, self.check_mask)
         if self.white_to_move:
-            if self.board[r-1][c] == "--":
-                if not pinned or pin_direction == (-1, 0):
-                    moves.append(Move((r,c), (r-1,c), self.board))
-                    if r == 6 and self.board[r-2][c] == "--":
-                        moves.append(Move((r,c), (r-2,c), self.board))
-
-            if c-1 >= 0:
-                if self.board[r-1][c-1][0] == "b":
-                    if not pinned or pin_direction == (-1, -1):
-                        moves.append(Move((r,c), (r-1,c-1), self.board))
-                elif (r-1, c-1) == self.en_passant_possible:
-                    if not pinned or pin_direction == (-1, -1):
-                        moves.append(Move((r,c), (r-1,c-1), self.board, is_en_passant = True))
-
-            if c+1 <= 7:
-                if self.board[r-1][c+1][0] == "b":
-                    if not pinned or pin_direction == (-1, 1):
-                        moves.append(Move((r,c), (r-1,c+1), self.board))
-                elif (r-1, c+1) == self.en_passant_possible:
-                    if not pinned or pin_direction == (-1, 1):
-                        moves.append(Move((r,c), (r-1,c+1), self.board, is_en_passant = True))
-
-
+            ally, enemy, step, start_row = "w", "b", -8, 6
         else:
-            if self.board[r+1][c] == "--":
-                if not pinned or pin_direction == (1, 0):
-                    moves.append(Move((r,c), (r+1,c), self.board))
-                    if r == 1 and self.board[r+2][c] == "--":
-                        moves.append(Move((r,c), (r+2,c), self.board))
-            if c-1 >= 0:
-                if self.board[r+1][c-1][0] == "w":
-                    if not pinned or pin_direction == (1, -1):
-                        moves.append(Move((r,c), (r+1,c-1), self.board))
-                elif (r+1, c-1) == self.en_passant_possible:
-                    if not pinned or pin_direction == (1, -1):
-                        moves.append(Move((r,c), (r+1,c-1), self.board, is_en_passant = True))
-
-            if c+1 <= 7:
-                if self.board[r+1][c+1][0] == "w":
-                    if not pinned or pin_direction == (1, 1):
-                        moves.append(Move((r,c), (r+1,c+1), self.board))
-                elif (r+1, c+1) == self.en_passant_possible:
-                    if not pinned or pin_direction == (1, 1):
-                        moves.append(Move((r,c), (r+1,c+1), self.board, is_en_passant = True))
-
-
-
+            ally, enemy, step, start_row = "b", "w", 8, 1
+
+        push = sq + step
+        if not (self.all_occupancy >> push) & 1:
+            if (allowed >> push) & 1:
+                self.add_pawn_move(sq, push, moves)
+                if r == start_row and not (self.all_occupancy >> (push + step)) & 1:
+                    moves.append(Move.from_squares(sq, push + step, self.board))
+
+        captures = PAWN_ATTACKS[ally][sq] & allowed & self.occupancy[enemy]
+        while captures:
+            bit = captures & -captures
+            captures ^= bit
+            self.add_pawn_move(sq, bit.bit_length() - 1, moves)
+        # en passant can also get out of check by taking the checking pawn without landing on its square,
+        # pins along the capture are left to en_passant_exposes_king
+        ep = self.en_passant_square
+        if ep is not None and (PAWN_ATTACKS[ally][sq] >> ep) & 1:
+            captured = r * 8 + (ep & 7)
+            if (self.check_mask >> ep) & 1 or (self.check_mask >> captured) & 1:
+                if not self.en_passant_exposes_king(sq, ep, captured):
+                    moves.append(Move.from_squares(sq, ep, self.board))
+
+    def en_passant_exposes_king(self, start, end, captured):
+        # both pawns leave the line at once, which the pin detection can't see (e.g. king and rook on the same rank)
+        if self.white_to_move:
+            enemy = "b"
+            king_sq = self.white_king_location[0] * 8 + self.white_king_location[1]
+        else:
+            enemy = "w"
+            king_sq = self.black_king_location[0] * 8 + self.black_king_location[1]
+        occupied = (self.all_occupancy & ~(1 << start) & ~(1 << captured)) | (1 << end)
+        queens = self.bitboards[enemy + "q"]
+        if slider_attacks(king_sq, occupied, ROOK_DIRECTIONS) & (self.bitboards[enemy + "r"] | queens):
+            return True
+        return bool(slider_attacks(king_sq, occupied, BISHOP_DIRECTIONS) & (self.bitboards[enemy + "b"] | queens))
+
+    def split_pawns(self, ally, enemy_color):
+        # pinned pawns and pawns that can capture en passant are moved one at a time through get_pawn_moves,
+        # returns the other pawns, which can be shifted all at once, and those
+        pawns = self.bitboards[ally + "p"]
+        single_moves = 0
+        for sq in self.pin_masks:
+            single_moves |= 1 << sq
+        if self.en_passant_square is not None:
+            single_moves |= PAWN_ATTACKS[enemy_color][self.en_passant_square]
+        single_moves &= pawns
+        return pawns & ~single_moves, single_moves
+
+    def get_all_pawn_moves(self, moves):
+        # unpinned pawns are pushed and captured all at once by shifting the whole pawn bitboard,
+        # the few pinned pawns and en passant captures go through get_pawn_moves square by square
+        ally, enemy_color = ("w", "b") if self.white_to_move else ("b", "w")
+        free, single_moves = self.split_pawns(ally, enemy_color)
+        check_mask = self.check_mask
+        enemy = self.occupancy[enemy_color] & check_mask
+        empty = ~self.all_occupancy & ALL_SQUARES
+        if self.white_to_move:
+            single = (free >> 8) & empty
+            self.add_pawn_moves(single & check_mask, 8, moves)
+            self.add_pawn_moves(((single & RANK_MASKS[5]) >> 8) & empty & check_mask, 16, moves)
+            self.add_pawn_moves(((free & ~FILE_MASKS[0]) >> 9) & enemy, 9, moves)
+            self.add_pawn_moves(((free & ~FILE_MASKS[7]) >> 7) & enemy, 7, moves)
+        else:
+            single = (free << 8) & empty
+            self.add_pawn_moves(single & check_mask, -8, moves)
+            self.add_pawn_moves(((single & RANK_MASKS[2]) << 8) & empty & check_mask, -16, moves)
+            self.add_pawn_moves(((free & ~FILE_MASKS[0]) << 7) & enemy, -7, moves)
+            self.add_pawn_moves(((free & ~FILE_MASKS[7]) << 9) & enemy, -9, moves)
+        while single_moves:
+            bit = single_moves & -single_moves
+            single_moves ^= bit
+            r, c = SQUARE_COORDS[bit.bit_length() - 1]
+            self.get_pawn_moves(r, c, moves)
+
+    def add_pawn_moves(self, targets, offset, moves):
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            end = bit.bit_length() - 1
+            self.add_pawn_move(end + offset, end, moves)
+
+    def add_pawn_move(self, start, end, moves):
+        if end < 8 or end >= 56:
+            for piece in "qrbn":
+                moves.append(Move.from_squares(start, end, self.board, piece))
+        else:
+            moves.append(Move.from_squares(start, end, self.board))
 
     def get_rook_moves(self, r, c, moves):
-        pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                if self.board[r][c][1] != "q":
-                    self.pins.remove(self.pins[i])
-                break
-
-
-        directions = ((-1,0),(0,-1),(1,0),(0,1))
-        opposing = "b" if self.white_to_move else "w"
-        for d in directions:
-            for i in range(1,8):
-                end_row = r + d[0] * i
-                end_col = c + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    if not pinned or pin_direction == d or pin_direction == (-d[0], -d[1]):
-                        end = self.board[end_row][end_col]
-                        if end == "--":
-                            moves.append(Move((r,c), (end_row, end_col), self.board))
-                        elif end[0] == opposing:
-                            moves.append(Move((r,c), (end_row, end_col), self.board))
-                            break
-                        else:
-                            break
-                else:
-                    break
-
-
+        allowed = self.pin_masks.get(r * 8 + c, self.check_mask)
+        ally = "w" if self.white_to_move else "b"
+        targets = slider_attacks(r * 8 + c, self.all_occupancy, ROOK_DIRECTIONS) & ~self.occupancy[ally] & allowed
+        self.add_moves(r * 8 + c, targets, moves)
 
     def get_knight_moves(self, r, c, moves):
-        pinned = False
-        for i in range(len(self.pins) -1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1]:
-                pinned = True
-                self.pins.remove(self.pins[i])
-                break
-
-        knight_moves = ((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1))
+        # a pinned knight can never stay on its pin line
+        if r * 8 + c in self.pin_masks:
+            return
         ally = "w" if self.white_to_move else "b"
-        for m in knight_moves:
-            end_row = r + m[0]
-            end_col = c + m[1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                if not pinned:
-                    end = self.board[end_row][end_col]
-                    if end[0] != ally:
-                        moves.append(Move((r,c), (end_row, end_col), self.board))
+        self.add_moves(r * 8 + c, KNIGHT_ATTACKS[r * 8 + c] & ~self.occupancy[ally] & self.check_mask, moves)
 
     def get_bishop_moves(self, r, c, moves):
-        pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) -1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-
-        directions = ((-1,-1),(-1,1),(1,-1),(1,1))
-        opposing = "b" if self.white_to_move else "w"
-        for d in directions:
-            for i in range(1,8):
-                end_row = r + d[0] * i
-                end_col = c + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    if not pinned or pin_direction == d or pin_direction == (-d[0], -d[1]):
-                        end = self.board[end_row][end_col]
-                        if end == "--":
-                            moves.append(Move((r,c), (end_row, end_col), self.board))
-                        elif end[0] == opposing:
-                            moves.append(Move((r,c), (end_row, end_col), self.board))
-                            break
-                        else:
-                            break
-                else:
-                    break
+        allowed = self.pin_masks.get(r * 8 + c, self.check_mask)
+        ally = "w" if self.white_to_move else "b"
+        targets = slider_attacks(r * 8 + c, self.all_occupancy, BISHOP_DIRECTIONS) & ~self.occupancy[ally] & allowed
+        self.add_moves(r * 8 + c, targets, moves)
 
     def get_queen_moves(self, r, c, moves):
         self.get_rook_moves(r, c, moves)
         self.get_bishop_moves(r, c, moves)
 
     def get_king_moves(self, r, c, moves):
-        row_moves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        col_moves = (-1, 0, 1, -1, 1, -1, 0, 1)
-        ally = "w" if self.white_to_move else "b"
-        for i in range(8):
-            end_row = r + row_moves[i]
-            end_col = c + col_moves[i]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                end = self.board[end_row][end_col]
-                if end[0] != ally:
-                    if ally == "w":
-                        self.white_king_location = (end_row, end_col)
-                    else:
-                        self.black_king_location = (end_row, end_col)
-                    in_check, pins, checks = self.pins_and_checks()
-                    if not in_check:
-                        moves.append(Move((r,c), (end_row, end_col), self.board))
-                    if ally == "w":
-                        self.white_king_location = (r,c)
-                    else:
-                        self.black_king_location = (r,c)
+        ally, enemy = ("w", "b") if self.white_to_move else ("b", "w")
+        sq = r * 8 + c
+        targets = KING_ATTACKS[sq] & ~self.occupancy[ally]
+        # the king is taken off the board so sliders checking it still attack the squares behind it
+        occupied = self.all_occupancy & ~(1 << sq)
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            end = bit.bit_length() - 1
+            if not self.is_attacked(end, enemy, occupied):
+                moves.append(Move.from_squares(sq, end, self.board))
 
     def get_castle_moves(self, r, c, moves):
         if self.square_under_attack(r, c):
             return
-        if (self.white_to_move and self.current_castling_rights.w_kingside) or (not self.white_to_move and self.current_castling_rights.b_kingside):
+        kingside, queenside = (WHITE_KINGSIDE, WHITE_QUEENSIDE) if self.white_to_move else (BLACK_KINGSIDE, BLACK_QUEENSIDE)
+        if self.castling & kingside:
             self.get_kingside_castle_moves(r, c, moves)
-        if (self.white_to_move and self.current_castling_rights.w_queenside) or (not self.white_to_move and self.current_castling_rights.b_queenside):
+        if self.castling & queenside:
             self.get_queenside_castle_moves(r, c, moves)
 
     def get_kingside_castle_moves(self, r, c, moves):
         if self.board[r][c+1] == "--" and self.board[r][c+2] == "--":
             if not self.square_under_attack(r, c+1) and not self.square_under_attack(r, c+2):
-                moves.append(Move((r,c), (r,c+2), self.board, is_castle_move=True))
+                moves.append(Move.from_squares(r * 8 + c, r * 8 + c + 2, self.board))
 
     def get_queenside_castle_moves(self, r, c, moves):
         if self.board[r][c-1] == "--" and self.board[r][c-2] == "--" and self.board[r][c-3] == "--":
             if not self.square_under_attack(r, c-1) and not self.square_under_attack(r, c-2):
-                moves.append(Move((r, c), (r,c-2), self.board, is_castle_move=True))
-
+                moves.append(Move.from_squares(r * 8 + c, r * 8 + c - 2, self.board))
 
 
-class CastleRights():
-    def __init__(self, w_kingside, b_kingside, w_queenside, b_queenside):
-        self.w_kingside = w_kingside
-        self.b_kingside = b_kingside
-        self.w_queenside = w_queenside
-        self.b_queenside = b_queenside
-
 
 class Move():
+    __slots__ = ("start_row", "start_col", "end_row", "end_col", "start_sq", "end_sq", "piece_moved", "piece_captured",
+                 "is_pawn_promotion", "promotion_piece", "is_en_passant", "is_castle_move", "moveID")
     ranks_to_rows = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
     rows_to_ranks = {v: k for k, v in ranks_to_rows.items()}
     files_to_cols = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
     cols_to_files = {v: k for k, v in files_to_cols.items()}
+    promotion_ids = {"q": 0, "n": 1, "b": 2, "r": 3}
+    # generated moves are shared: piece moved -> piece on the target square -> moveID -> Move
+    cache = {piece: {captured: {} for captured in PIECES + ("--",)} for piece in PIECES}
 
-
-    def __init__(self, start, end, board, is_en_passant = False, is_castle_move = False):
+    def __init__(self, start, end, board, is_en_passant = False, is_castle_move = False, promotion_piece = "q"):
         self.start_row = start[0]
         self.start_col = start[1]
         self.end_row = end[0]
         self.end_col = end[1]
+        self.start_sq = self.start_row * 8 + self.start_col
+        self.end_sq = self.end_row * 8 + self.end_col
         self.piece_moved = board[self.start_row][self.start_col]
         self.piece_captured = board[self.end_row][self.end_col]
 
         self.is_pawn_promotion = False
         if (self.piece_moved == "wp" and self.end_row == 0) or (self.piece_moved == "bp" and self.end_row == 7):
             self.is_pawn_promotion = True
+        self.promotion_piece = promotion_piece if self.is_pawn_promotion else ""
 
         self.is_en_passant = is_en_passant
         if self.is_en_passant:
@@ -491,7 +838,27 @@ class Move():
 
         self.is_castle_move = is_castle_move
 
-        self.moveID = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
+        # packed into 16 bits: start square, end square and promotion piece
+        self.moveID = self.start_sq | self.end_sq << 6
+        if self.is_pawn_promotion:
+            self.moveID |= self.promotion_ids[promotion_piece] << 12
+
+    @staticmethod
+    def from_squares(start, end, board, promotion_piece = "q"):
+        # used by the move generators: a move is fully determined by its moveID plus the piece moved and
+        # the piece on the target square, so each one is built once and handed out again afterwards
+        piece_moved = board[start >> 3][start & 7]
+        piece_captured = board[end >> 3][end & 7]
+        moves = Move.cache[piece_moved][piece_captured]
+        move_id = start | end << 6 | Move.promotion_ids[promotion_piece] << 12
+        move = moves.get(move_id)
+        if move is None:
+            # pawns moving diagonally onto an empty square capture en passant, kings moving two squares castle
+            is_en_passant = piece_moved[1] == "p" and piece_captured == "--" and (start - end) & 7 != 0
+            is_castle_move = piece_moved[1] == "k" and abs(start - end) == 2
+            move = Move(SQUARE_COORDS[start], SQUARE_COORDS[end], board, is_en_passant, is_castle_move, promotion_piece)
+            moves[move_id] = move
+        return move
 
     def __eq__(self, other):
         if isinstance(other, Move):
@@ -500,7 +867,7 @@ class Move():
 
 
     def get_notation(self):
-        return self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
+        return self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col) + self.promotion_piece
 
     def get_rank_file(self, r, c):
         return self.cols_to_files[c] + self.rows_to_ranks[r]
@@ -0,0 +1,74 @@
+import re
+import sys
+import time
+
+import engine
+import chess_ai
+import book
+
+# Runs EPD test suites: every position is searched for a fixed time and counts as solved when the
+# move played is one of its best moves (bm) and none of its avoid moves (am).
+TIME_LIMIT_MS = 1000
+OPERATION_PATTERN = re.compile(r'\s*(\w+)\s*((?:"[^"]*"|[^;])*);')
+
+
+def parse_epd(line):
+    # returns (fen, operations) where operations maps each opcode to its list of operands
+    fields = line.split(None, 4)
+    operations = {}
+    for opcode, operands in OPERATION_PATTERN.findall(fields[4] if len(fields) > 4 else ""):
+        operations[opcode] = [operand.strip('"') for operand in re.findall(r'"[^"]*"|\S+', operands)]
+    halfmove_clock = operations.get("hmvc", ["0"])[0]
+    fullmove_number = operations.get("fmvn", ["1"])[0]
+    return " ".join(fields[:4] + [halfmove_clock, fullmove_number]), operations
+
+
+def read_epd(path):
+    with open(path) as f:
+        for line in f:
+            if line.strip() and not line.startswith("#"):
+                yield parse_epd(line)
+
+
+def solve(fen, operations, time_limit_ms=TIME_LIMIT_MS):
+    # returns (solved, move played in SAN, nodes, seconds)
+    gs = engine.GameState(fen)
+    valid_moves = gs.get_valid_moves()
+    best_moves = [book.parse_move(gs, san, valid_moves) for san in operations.get("bm", [])]
+    avoid_moves = [book.parse_move(gs, san, valid_moves) for san in operations.get("am", [])]
+    chess_ai.transposition_table.clear()
+    start = time.perf_counter()
+    move, iterations = chess_ai.iterative_deepening(gs, valid_moves, time_limit_ms)
+    seconds = time.perf_counter() - start
+    solved = move is not None and (not best_moves or move in best_moves) and move not in avoid_moves
+    return solved, book.move_to_san(gs, move, valid_moves) if move is not None else "-", chess_ai.nodes_searched, seconds
+
+
+def run_suite(path, time_limit_ms=TIME_LIMIT_MS):
+    # returns the number of positions solved
+    solved_count = 0
+    total = 0
+    total_nodes = 0
+    total_time = 0
+    for fen, operations in read_epd(path):
+        solved, san, nodes, seconds = solve(fen, operations, time_limit_ms)
+        total += 1
+        solved_count += solved
+        total_nodes += nodes
+        total_time += seconds
+        expected = " ".join(" ".join([opcode] + operations[opcode]) for opcode in ("bm", "am") if opcode in operations)
+        print("{:<16} {:<8} {:<20} {:>4} {:>9} nodes {:>9.0f} nps".format(
+            operations.get("id", [str(total)])[0], san, expected, "ok" if solved else "FAIL", nodes,
+            nodes / seconds if seconds else 0))
+    print("solved {}/{} ({:.1f}%), {} nodes in {:.1f}s, {:.0f} nps".format(
+        solved_count, total, 100 * solved_count / total if total else 0, total_nodes, total_time,
+        total_nodes / total_time if total_time else 0))
+    return solved_count
+
+
+if __name__ == "__main__":
+    # epd.py <suite.epd> [time_ms]
+    if len(sys.argv) < 2:
+        print("usage: epd.py <suite.epd> [time_ms]")
+        sys.exit(1)
+    run_suite(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else TIME_LIMIT_MS)
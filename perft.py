@@ -0,0 +1,109 @@
+import sys
+import time
+
+import engine
+
+# standard positions with their published node counts per depth
+PERFT_SUITE = [
+    ("start", engine.START_FEN,
+     [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624]),
+    ("position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("position 4 mirrored", "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+     [6, 264, 9467, 422333]),
+    ("position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+    ("position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+    # castling rights in the FEN without the king and rook to use them are dropped on loading
+    ("stale castling", "4k3/8/8/8/8/8/8/4K3 w K - 0 1",
+     [5, 25, 170, 1156]),
+]
+MAX_NODES = 200000  # default cap on the expected count of a suite entry
+
+# move sequences with how often the position they end in has been on the board, the same position
+# has to get the same key however it was reached
+REPETITION_SUITE = [
+    ("knights after e4", engine.START_FEN, "e2e4 g8f6 g1f3 f6g8 f3g1", 2),
+    ("knights after e4 x2", engine.START_FEN, "e2e4 g8f6 g1f3 f6g8 f3g1 g8f6 g1f3 f6g8 f3g1", 3),
+    ("capturable ep", "4k3/8/8/8/5p2/8/4P3/4K3 w - - 0 1", "e2e4 e8d8 e1d1 d8e8 d1e1", 1),
+]
+
+
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.get_valid_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.make_move(move)
+        nodes += perft(gs, depth - 1)
+        gs.undo_move()
+    return nodes
+
+
+def divide(gs, depth):
+    counts = {}
+    for move in gs.get_valid_moves():
+        gs.make_move(move)
+        counts[move.get_notation()] = perft(gs, depth - 1)
+        gs.undo_move()
+    return counts
+
+
+def run_suite(max_nodes=MAX_NODES):
+    # runs every suite position up to the deepest depth whose expected count is within max_nodes,
+    # returns the number of mismatches
+    failures = 0
+    total_nodes = 0
+    total_time = 0
+    for name, fen, expected in PERFT_SUITE:
+        gs = engine.GameState(fen)
+        for depth, expected_nodes in enumerate(expected, 1):
+            if expected_nodes > max_nodes:
+                break
+            start = time.perf_counter()
+            nodes = perft(gs, depth)
+            seconds = time.perf_counter() - start
+            total_nodes += nodes
+            total_time += seconds
+            status = "ok" if nodes == expected_nodes else "FAIL expected {}".format(expected_nodes)
+            if nodes != expected_nodes:
+                failures += 1
+            print("{:<20} depth {} {:>10} nodes {:>8.2f}s {:>9.0f} nps  {}".format(
+                name, depth, nodes, seconds, nodes / seconds if seconds else 0, status))
+    print("total {} nodes in {:.2f}s, {:.0f} nps, {} failures".format(
+        total_nodes, total_time, total_nodes / total_time if total_time else 0, failures))
+    return failures + run_repetitions()
+
+
+def run_repetitions():
+    # returns the number of positions whose repetition count is wrong
+    failures = 0
+    for name, fen, moves, expected in REPETITION_SUITE:
+        gs = engine.GameState(fen)
+        for notation in moves.split():
+            gs.make_move(next(move for move in gs.get_valid_moves() if move.get_notation() == notation))
+        count = gs.repetitions[gs.zobrist_key]
+        if count != expected:
+            failures += 1
+        print("{:<20} seen {} times  {}".format(name, count, "ok" if count == expected else "FAIL expected {}".format(expected)))
+    return failures
+
+
+if __name__ == "__main__":
+    # perft.py [suite [max_nodes]] | perft.py divide <depth> [fen]
+    if len(sys.argv) > 2 and sys.argv[1] == "divide":
+        gs = engine.GameState(sys.argv[3] if len(sys.argv) > 3 else None)
+        counts = divide(gs, int(sys.argv[2]))
+        for notation in sorted(counts):
+            print("{}: {}".format(notation, counts[notation]))
+        print("total: {}".format(sum(counts.values())))
+    else:
+        sys.exit(1 if run_suite(int(sys.argv[2]) if len(sys.argv) > 2 else MAX_NODES) else 0)
@@ -0,0 +1,115 @@
+import datetime
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import engine
+import chess_ai
+import book
+
+# Engine against engine games played concurrently over a process pool. Each game is written to the PGN
+# file as soon as it finishes so nothing is held back, and the running games per hour is printed as
+# the throughput figure to compare engine changes with.
+DEFAULT_SETTINGS = {"time": 100, "depth": chess_ai.MAX_DEPTH, "nodes": None}
+RANDOM_PLIES = 4  # random opening moves so the games don't all repeat each other
+MAX_PLIES = 300  # adjudicated as a draw after this many plies
+PGN_PATH = "selfplay.pgn"
+
+
+def play_game(round_number, white, black, random_plies=RANDOM_PLIES, max_plies=MAX_PLIES, seed=None):
+    # plays one game in a pool worker, returns (round, result, plies, pgn text)
+    rng = random.Random(seed)
+    gs = engine.GameState()
+    chess_ai.transposition_table.clear()
+    sans = []
+    termination = "normal"
+    while True:
+        valid_moves = gs.get_valid_moves()
+        if gs.checkmate:
+            result = "0-1" if gs.white_to_move else "1-0"
+            break
+        if gs.stalemate or gs.is_draw():
+            result = "1/2-1/2"
+            break
+        if len(gs.move_log) >= max_plies:
+            result = "1/2-1/2"
+            termination = "adjudication"
+            break
+        if len(gs.move_log) < random_plies:
+            move = rng.choice(valid_moves)
+        else:
+            settings = white if gs.white_to_move else black
+            move, iterations = chess_ai.iterative_deepening(gs, valid_moves, settings["time"], settings["nodes"],
+                                                            settings["depth"])
+            if move is None:
+                # out of time before the first move was searched
+                move = chess_ai.find_random_move(valid_moves)
+        sans.append(book.move_to_san(gs, move, valid_moves))
+        gs.make_move(move)
+
+    headers = [("Event", "Self-play"), ("Site", "?"), ("Date", datetime.date.today().strftime("%Y.%m.%d")),
+               ("Round", str(round_number)), ("White", describe(white)), ("Black", describe(black)),
+               ("Result", result), ("Termination", termination), ("PlyCount", str(len(sans)))]
+    tokens = []
+    for i, san in enumerate(sans):
+        tokens.append("{}. {}".format(i // 2 + 1, san) if i % 2 == 0 else san)
+    tokens.append(result)
+    lines = [""]
+    for token in tokens:
+        if len(lines[-1]) + len(token) + 1 > 80:
+            lines.append("")
+        lines[-1] = (lines[-1] + " " + token).lstrip()
+    pgn = "".join('[{} "{}"]\n'.format(name, value) for name, value in headers) + "\n" + "\n".join(lines) + "\n\n"
+    return round_number, result, len(sans), pgn
+
+
+def describe(settings):
+    return " ".join("{}={}".format(name, value) for name, value in sorted(settings.items())
+                    if value is not None and value != DEFAULT_SETTINGS.get(name)) or "default"
+
+
+def run(games, workers=chess_ai.WORKERS, white=None, black=None, random_plies=RANDOM_PLIES, max_plies=MAX_PLIES,
+        pgn_path=PGN_PATH, seed=0):
+    # returns the score of the white settings over all games
+    white = dict(DEFAULT_SETTINGS, **(white or {}))
+    black = dict(DEFAULT_SETTINGS, **(black or {}))
+    results = {"1-0": 0, "0-1": 0, "1/2-1/2": 0}
+    start = time.perf_counter()
+    with open(pgn_path, "a") as pgn_file, ProcessPoolExecutor(workers, initializer=chess_ai.load_bitbases) as pool:
+        futures = [pool.submit(play_game, i + 1, white, black, random_plies, max_plies, seed + i) for i in range(games)]
+        for finished, future in enumerate(as_completed(futures), 1):
+            round_number, result, plies, pgn = future.result()
+            pgn_file.write(pgn)
+            pgn_file.flush()
+            results[result] += 1
+            hours = (time.perf_counter() - start) / 3600
+            print("game {:>4} {:<8} {:>4} plies   +{} ={} -{}   {:.0f} games/hour".format(
+                round_number, result, plies, results["1-0"], results["1/2-1/2"], results["0-1"], finished / hours))
+    return results["1-0"] + results["1/2-1/2"] / 2
+
+
+def parse_settings(arguments):
+    # key=value arguments: workers, random_plies, max_plies, seed, pgn, and time/depth/nodes for both
+    # sides or white.time, black.depth and so on for one
+    options = {"white": {}, "black": {}}
+    for argument in arguments:
+        name, value = argument.split("=", 1)
+        if name == "pgn":
+            options["pgn_path"] = value
+        elif name in ("workers", "random_plies", "max_plies", "seed"):
+            options[name] = int(value)
+        else:
+            sides = [name.split(".")[0]] if "." in name else ["white", "black"]
+            for side in sides:
+                options[side][name.split(".")[-1]] = int(value) if value != "none" else None
+    return options
+
+
+if __name__ == "__main__":
+    # selfplay.py <games> [key=value ...], e.g. selfplay.py 100 white.depth=4 black.time=200 workers=8
+    if len(sys.argv) < 2:
+        print("usage: selfplay.py <games> [workers=n] [random_plies=n] [max_plies=n] [seed=n] [pgn=path] "
+              "[time|depth|nodes=n] [white.time|white.depth|white.nodes=n] [black....=n]")
+        sys.exit(1)
+    run(int(sys.argv[1]), **parse_settings(sys.argv[2:]))
@@ -0,0 +1,141 @@
+import sys
+import threading
+
+import engine
+import chess_ai
+import book
+
+# Headless engine speaking the UCI protocol on stdin/stdout, for tournament managers and batch jobs.
+# Nothing here (or in what it imports) touches pygame.
+ENGINE_NAME = "chess_ai"
+MOVE_OVERHEAD_MS = 50  # kept back from every clock allocation for the time it takes to get the move out
+DEFAULT_MOVES_TO_GO = 30
+
+
+class UCIEngine():
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.output_lock = threading.Lock()
+        self.gs = engine.GameState()
+        self.stop = threading.Event()
+        self.search_thread = None
+
+    def send(self, line):
+        # the search thread reports too, so lines are written whole
+        with self.output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def handle(self, line):
+        # returns False once the engine should exit
+        tokens = line.split()
+        if not tokens:
+            return True
+        command = tokens[0]
+        if command == "uci":
+            self.send("id name {}".format(ENGINE_NAME))
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.stop_search()
+            self.gs = engine.GameState()
+            chess_ai.transposition_table.clear()
+        elif command == "position":
+            self.stop_search()
+            self.set_position(tokens[1:])
+        elif command == "go":
+            self.stop_search()
+            self.start_search(tokens[1:])
+        elif command == "stop":
+            self.stop_search()
+        elif command == "quit":
+            self.stop_search()
+            return False
+        return True
+
+    def set_position(self, tokens):
+        # position startpos [moves ...] | position fen <fen> [moves ...]
+        moves = tokens.index("moves") if "moves" in tokens else len(tokens)
+        if tokens and tokens[0] == "fen":
+            self.gs = engine.GameState(" ".join(tokens[1:moves]))
+        else:
+            self.gs = engine.GameState()
+        for notation in tokens[moves + 1:]:
+            move = book.parse_move(self.gs, notation)
+            if move is None:
+                self.send("info string illegal move {}".format(notation))
+                break
+            self.gs.make_move(move)
+
+    def start_search(self, tokens):
+        # go [movetime ms] [depth n] [nodes n] [wtime ms] [btime ms] [winc ms] [binc ms] [movestogo n] [infinite]
+        options = {}
+        for i, token in enumerate(tokens):
+            if token in ("movetime", "depth", "nodes", "wtime", "btime", "winc", "binc", "movestogo") and i + 1 < len(tokens):
+                options[token] = int(tokens[i + 1])
+        time_limit_ms = options.get("movetime")
+        clock = options.get("wtime" if self.gs.white_to_move else "btime")
+        if time_limit_ms is None and clock is not None:
+            increment = options.get("winc" if self.gs.white_to_move else "binc", 0)
+            time_limit_ms = allocate_time(clock, increment, options.get("movestogo"))
+        if time_limit_ms is None and "depth" not in options and "nodes" not in options and "infinite" not in tokens:
+            time_limit_ms = chess_ai.TIME_LIMIT_MS
+        self.stop.clear()
+        self.search_thread = threading.Thread(target=self.search, args=(time_limit_ms, options.get("nodes"),
+                                                                         options.get("depth", chess_ai.MAX_DEPTH),
+                                                                         "infinite" in tokens))
+        self.search_thread.start()
+
+    def stop_search(self):
+        if self.search_thread is not None:
+            self.stop.set()
+            self.search_thread.join()
+            self.search_thread = None
+
+    def search(self, time_limit_ms, node_limit, max_depth, infinite=False):
+        valid_moves = self.gs.get_valid_moves()
+        best_move, iterations = chess_ai.iterative_deepening(self.gs, valid_moves, time_limit_ms, node_limit, max_depth,
+                                                             stop=self.stop, report=self.report)
+        stats = chess_ai.search_stats
+        self.send("info nodes {} time {} nps {}".format(stats.nodes, round(stats.seconds * 1000), round(stats.nps)))
+        if infinite:
+            # the search can end by itself on a mate or at MAX_DEPTH, bestmove still has to wait for stop
+            self.stop.wait()
+        self.send("bestmove {}".format(best_move.get_notation() if best_move is not None else "0000"))
+
+    def report(self, move, stats):
+        # an info line as soon as each depth completes
+        entry = stats.depths[-1]
+        self.send("info depth {} score {} nodes {} time {} nps {} pv {}".format(
+            entry["depth"], format_score(entry["score"]), entry["nodes"], entry["time_ms"],
+            entry["nodes"] * 1000 // max(entry["time_ms"], 1), " ".join(entry["pv"])))
+
+
+def allocate_time(clock, increment, moves_to_go=None):
+    # an even share of the clock over the moves still to play plus most of the increment,
+    # never more than half of what is left
+    moves_to_go = moves_to_go or DEFAULT_MOVES_TO_GO
+    time_limit_ms = clock // moves_to_go + increment * 3 // 4
+    return max(1, min(time_limit_ms, clock // 2) - MOVE_OVERHEAD_MS)
+
+
+def format_score(score):
+    # search scores are in centipawns from the side to move's point of view
+    if abs(score) > chess_ai.MATE_THRESHOLD:
+        plies = chess_ai.CHECKMATE - abs(score)
+        return "mate {}".format((plies + 1) // 2 if score > 0 else -((plies + 1) // 2))
+    return "cp {}".format(score)
+
+
+def main():
+    chess_ai.load_bitbases()
+    uci_engine = UCIEngine()
+    for line in sys.stdin:
+        if not uci_engine.handle(line):
+            break
+    uci_engine.stop_search()
+
+
+if __name__ == "__main__":
+    main()